@@ -4,12 +4,78 @@
 Effectful interface to boto.
 """
 
-import os
+import threading
+from datetime import timedelta
+from functools import partial
+from hashlib import md5
+from itertools import chain
+
 from characteristic import attributes, Attribute
-from effect import Effect, sync_performer, TypeDispatcher
+from concurrent.futures import ThreadPoolExecutor
+from effect import (
+    Effect, FirstError, ParallelEffects, parallel, sync_perform,
+    sync_performer, TypeDispatcher,
+)
 from effect.do import do
+from six import reraise
 
 import boto
+from boto.exception import BotoServerError
+from boto.s3.multipart import MultiPartUpload
+from boto.s3.website import RoutingRules
+from boto.utils import compute_md5
+
+from flocker.common import retry_if, with_retry
+
+
+_connections = threading.local()
+
+
+def _s3_connection():
+    """
+    Get a connection to S3 for the current thread.
+
+    boto connections aren't thread-safe, so they can't be shared between the
+    threads performing effects concurrently. Reusing a connection within each
+    thread still lets boto keep its HTTPS connections open, rather than
+    paying for a new TLS handshake for every request.
+
+    :return: A ``boto.s3.connection.S3Connection``.
+    """
+    connection = getattr(_connections, 's3', None)
+    if connection is None:
+        connection = _connections.s3 = boto.connect_s3()
+    return connection
+
+
+# The maximum number of threads used to perform the children of a single
+# ``ParallelEffects``.
+PARALLEL_EFFECTS_WORKERS = 64
+
+
+@sync_performer
+def perform_parallel_effects(dispatcher, intent):
+    """
+    Perform the children of an :class:`effect.ParallelEffects` concurrently,
+    using up to ``PARALLEL_EFFECTS_WORKERS`` threads.
+
+    :raises FirstError: If any of the child effects fail.
+    :return: A list of the results of the child effects, in order.
+    """
+    workers = max(min(len(intent.effects), PARALLEL_EFFECTS_WORKERS), 1)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(sync_perform, dispatcher, effect)
+                   for effect in intent.effects]
+    for index, future in enumerate(futures):
+        exception, traceback = future.exception_info()
+        if exception is not None:
+            reraise(
+                FirstError,
+                FirstError(
+                    exc_info=(type(exception), exception, traceback),
+                    index=index),
+                traceback)
+    return [future.result() for future in futures]
 
 
 @attributes([
@@ -20,21 +86,44 @@ class UpdateS3RoutingRules(object):
     """
     Update the routing rules for an S3 bucket website endpoint.
 
+    If the routing rules are changed, return the old routing rules.
+
     :ivar bytes bucket: Name of bucket to change routing rule for.
     :ivar boto.s3.website.RoutingRules routing_rules: New routing rules.
     """
 
 
+def _same_routing_rules(old_routing_rules, new_routing_rules):
+    """
+    Check whether two sets of routing rules are the same.
+
+    ``boto.s3.website.RoutingRules`` doesn't implement equality, so compare
+    the XML sent to S3 instead.
+
+    :param boto.s3.website.RoutingRules old_routing_rules: The current
+        routing rules.
+    :param boto.s3.website.RoutingRules new_routing_rules: The new routing
+        rules.
+    """
+    return old_routing_rules.to_xml() == new_routing_rules.to_xml()
+
+
 @sync_performer
 def perform_update_s3_routing_rules(dispatcher, intent):
     """
     See :class:`UpdateS3RoutingRule`.
     """
-    s3 = boto.connect_s3()
+    s3 = _s3_connection()
     bucket = s3.get_bucket(intent.bucket)
     config = bucket.get_website_configuration_obj()
+    old_routing_rules = config.routing_rules
+    if old_routing_rules is None:
+        old_routing_rules = RoutingRules()
+    if _same_routing_rules(old_routing_rules, intent.routing_rules):
+        return None
     config.routing_rules = intent.routing_rules
     bucket.set_website_configuration(config)
+    return old_routing_rules
 
 
 @attributes([
@@ -63,7 +152,7 @@ def perform_update_s3_error_page(dispatcher, intent):
     """
     See :class:`UpdateS3ErrorPage`.
     """
-    s3 = boto.connect_s3()
+    s3 = _s3_connection()
     bucket = s3.get_bucket(intent.bucket)
     config = bucket.get_website_configuration_obj()
     new_error_key = intent.error_key
@@ -90,6 +179,57 @@ class CreateCloudFrontInvalidation(object):
     """
 
 
+# The maximum number of paths CloudFront accepts in a single invalidation
+# request.
+CLOUDFRONT_INVALIDATION_BATCH_SIZE = 1000
+
+# CloudFront only allows a few invalidation requests to be in progress at
+# once, so there is no point in submitting more than that concurrently.
+CLOUDFRONT_INVALIDATION_WORKERS = 3
+
+
+def _chunks(items, size):
+    """
+    Split ``items`` into lists of at most ``size`` elements.
+
+    :param items: An iterable of items to split.
+    :param int size: The maximum size of each chunk.
+
+    :return: A list of lists.
+    """
+    items = list(items)
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def _retry_on_error_codes(error_codes, steps=None):
+    """
+    Create a decorator that retries a boto call, with exponential backoff,
+    if it fails with one of the given AWS error codes.
+
+    :param error_codes: The ``error_code`` values of ``BotoServerError``
+        which should be retried.
+    :param steps: The delays between attempts, as ``timedelta`` instances.
+
+    :return: A function which decorates a callable to retry.
+    """
+    if steps is None:
+        steps = [timedelta(seconds=2 ** i) for i in range(6)]
+    return partial(
+        with_retry,
+        should_retry=retry_if(
+            lambda e: (isinstance(e, BotoServerError) and
+                       e.error_code in error_codes)),
+        steps=steps,
+    )
+
+
+_retry_throttled_invalidation = _retry_on_error_codes(
+    {'TooManyInvalidationsInProgress', 'Throttling'})
+
+_retry_throttled_s3 = _retry_on_error_codes(
+    {'SlowDown', 'ServiceUnavailable'})
+
+
 @sync_performer
 def perform_create_cloudfront_invalidation(dispatcher, intent):
     """
@@ -98,7 +238,18 @@ def perform_create_cloudfront_invalidation(dispatcher, intent):
     cf = boto.connect_cloudfront()
     distribution = [dist for dist in cf.get_all_distributions()
                     if intent.cname in dist.cnames][0]
-    cf.create_invalidation_request(distribution.id, intent.paths)
+    create_invalidation_request = _retry_throttled_invalidation(
+        cf.create_invalidation_request)
+    batches = _chunks(sorted(intent.paths),
+                      CLOUDFRONT_INVALIDATION_BATCH_SIZE)
+    with ThreadPoolExecutor(
+        max_workers=CLOUDFRONT_INVALIDATION_WORKERS
+    ) as pool:
+        requests = [
+            pool.submit(create_invalidation_request, distribution.id, batch)
+            for batch in batches]
+    for request in requests:
+        request.result()
 
 
 @attributes([
@@ -115,16 +266,54 @@ class DeleteS3Keys(object):
     """
 
 
+# The maximum number of keys S3 accepts in a single multi-object delete
+# request.
+S3_DELETE_BATCH_SIZE = 1000
+
+# The number of multi-object delete requests to make concurrently.
+S3_DELETE_WORKERS = 8
+
+
+class S3DeleteFailed(Exception):
+    """
+    Raised if S3 fails to delete some of the keys of a :class:`DeleteS3Keys`.
+
+    The arguments are the name of the bucket and a list of ``(key, code,
+    message)`` tuples describing each key that wasn't deleted.
+    """
+
+
+def _delete_s3_keys(bucket_name, keys):
+    """
+    Delete keys from an S3 bucket with a single multi-object delete request.
+
+    :param bytes bucket_name: Name of bucket to delete keys from.
+    :param list keys: Names of the keys to delete.
+
+    :raises S3DeleteFailed: If any of the keys weren't deleted.
+    """
+    s3 = _s3_connection()
+    bucket = s3.get_bucket(bucket_name)
+    result = _retry_throttled_s3(bucket.delete_keys)(keys, quiet=True)
+    if result.errors:
+        raise S3DeleteFailed(
+            bucket_name,
+            [(error.key, error.code, error.message)
+             for error in result.errors])
+
+
 @sync_performer
 def perform_delete_s3_keys(dispatcher, intent):
     """
     See :class:`DeleteS3Keys`.
     """
-    s3 = boto.connect_s3()
-    bucket = s3.get_bucket(intent.bucket)
-    bucket.delete_keys(
-        [intent.prefix + key
-         for key in intent.keys])
+    batches = _chunks([intent.prefix + key for key in intent.keys],
+                      S3_DELETE_BATCH_SIZE)
+    with ThreadPoolExecutor(max_workers=S3_DELETE_WORKERS) as pool:
+        deletions = [pool.submit(_delete_s3_keys, intent.bucket, batch)
+                     for batch in batches]
+    for deletion in deletions:
+        deletion.result()
 
 
 @attributes([
@@ -165,15 +354,26 @@ EXTENSION_MIME_TYPES = {
 }
 
 
-@sync_performer
-def perform_copy_s3_keys(dispatcher, intent):
+# The number of keys to copy concurrently.
+S3_COPY_WORKERS = 128
+
+# The number of keys each copying task copies.
+S3_COPY_BATCH_SIZE = 16
+
+
+def _copy_s3_keys(intent, keys):
     """
-    See :class:`CopyS3Keys`.
+    Copy keys from one S3 bucket to another, without the contents passing
+    through this host.
+
+    :param CopyS3Keys intent: The copy being performed.
+    :param list keys: The keys from ``intent`` to copy.
     """
-    s3 = boto.connect_s3()
+    s3 = _s3_connection()
     source_bucket = s3.get_bucket(intent.source_bucket)
-    for key in intent.keys:
-        source_key = source_bucket.get_key(intent.source_prefix + key)
+    for key in keys:
+        source_key = _retry_throttled_s3(source_bucket.get_key)(
+            intent.source_prefix + key)
 
         # We are explicit about Content-Type here, since the upload tool
         # isn't smart enough to set the right Content-Type.
@@ -183,16 +383,30 @@ def perform_copy_s3_keys(dispatcher, intent):
                 destination_metadata['Content-Type'] = content_type
                 break
 
-        source_key.copy(
+        _retry_throttled_s3(source_key.copy)(
             dst_bucket=intent.destination_bucket,
             dst_key=intent.destination_prefix + key,
             metadata=destination_metadata,
         )
 
 
+@sync_performer
+def perform_copy_s3_keys(dispatcher, intent):
+    """
+    See :class:`CopyS3Keys`.
+    """
+    batches = _chunks(intent.keys, S3_COPY_BATCH_SIZE)
+    with ThreadPoolExecutor(max_workers=S3_COPY_WORKERS) as pool:
+        copies = [pool.submit(_copy_s3_keys, intent, batch)
+                  for batch in batches]
+    for copy in copies:
+        copy.result()
+
+
 @attributes([
     "bucket",
     "prefix",
+    Attribute("parallelism", default_value=1),
 ])
 class ListS3Keys(object):
     """
@@ -202,7 +416,72 @@ class ListS3Keys(object):
 
     :ivar bytes bucket: Name of bucket to list keys from.
     :ivar bytes prefix: Prefix of keys to be listed.
+    :ivar int parallelism: Number of disjoint ranges of keys to list
+        concurrently.
+    """
+
+
+# The characters S3 keys are split on when listing a bucket in parallel.
+# Keys with other characters after the prefix still end up in the first or
+# last range.
+_KEY_CHARACTERS = [chr(c) for c in range(0x20, 0x7f)]
+
+
+def _split_markers(prefix, parallelism):
+    """
+    Split the keys under ``prefix`` into ``parallelism`` contiguous ranges.
+
+    :param bytes prefix: Prefix of the keys to be split.
+    :param int parallelism: Number of ranges to split the keys into.
+
+    :return: A list of markers, one longer than the number of ranges. Range
+        ``i`` holds the keys greater than marker ``i`` and not greater than
+        marker ``i + 1``. A marker of ``None`` is unbounded.
+    """
+    parallelism = max(1, min(parallelism, len(_KEY_CHARACTERS)))
+    step = float(len(_KEY_CHARACTERS)) / parallelism
+    boundaries = [prefix + _KEY_CHARACTERS[int(round(i * step))]
+                  for i in range(1, parallelism)]
+    return [None] + boundaries + [None]
+
+
+def _list_key_range(bucket_name, prefix, start, end):
+    """
+    List the keys under ``prefix`` in the range ``(start, end]``.
+
+    :param bytes bucket_name: Name of bucket to list keys from.
+    :param bytes prefix: Prefix of keys to be listed.
+    :param start: Marker to list keys after, or ``None``.
+    :param end: Last key that may be listed, or ``None``.
+
+    :return: A list of key names with ``prefix`` stripped.
     """
+    s3 = _s3_connection()
+    bucket = s3.get_bucket(bucket_name)
+    names = []
+    for key in bucket.list(prefix, marker=start or ''):
+        if end is not None and key.name > end:
+            break
+        names.append(key.name[len(prefix):])
+    return names
+
+
+def _bisect_list(bucket_name, prefix, parallelism):
+    """
+    List the keys under ``prefix``, fetching disjoint ranges of the key space
+    concurrently.
+
+    :param bytes bucket_name: Name of bucket to list keys from.
+    :param bytes prefix: Prefix of keys to be listed.
+    :param int parallelism: Number of ranges to list concurrently.
+
+    :return: A set of key names with ``prefix`` stripped.
+    """
+    markers = _split_markers(prefix, parallelism)
+    with ThreadPoolExecutor(max_workers=len(markers) - 1) as pool:
+        ranges = [pool.submit(_list_key_range, bucket_name, prefix, start, end)
+                  for start, end in zip(markers, markers[1:])]
+    return set(chain.from_iterable(r.result() for r in ranges))
 
 
 @sync_performer
@@ -210,7 +489,9 @@ def perform_list_s3_keys(dispatcher, intent):
     """
     See :class:`ListS3Keys`.
     """
-    s3 = boto.connect_s3()
+    if intent.parallelism > 1:
+        return _bisect_list(intent.bucket, intent.prefix, intent.parallelism)
+    s3 = _s3_connection()
     bucket = s3.get_bucket(intent.bucket)
     return {key.name[len(intent.prefix):]
             for key in bucket.list(intent.prefix)}
@@ -240,21 +521,26 @@ def perform_download_s3_key_recursively(dispatcher, intent):
     """
     See :class:`DownloadS3KeyRecursively`.
     """
+    key_prefix = intent.source_prefix + '/'
     keys = yield Effect(
-        ListS3Keys(prefix=intent.source_prefix + '/',
+        ListS3Keys(prefix=key_prefix,
                    bucket=intent.source_bucket))
-    for key in keys:
-        if not key.endswith(intent.filter_extensions):
-            continue
-        path = intent.target_path.preauthChild(key)
-
-        if not path.parent().exists():
-            path.parent().makedirs()
-        source_key = os.path.join(intent.source_prefix, key)
-        yield Effect(
+    downloads = [(key_prefix + key, intent.target_path.preauthChild(key))
+                 for key in keys
+                 if key.endswith(intent.filter_extensions)]
+
+    # Create all the directories before starting the downloads, so that
+    # concurrent downloads don't race to create them.
+    for directory in {target.parent() for _, target in downloads}:
+        if not directory.exists():
+            directory.makedirs()
+
+    yield parallel([
+        Effect(
             DownloadS3Key(source_bucket=intent.source_bucket,
-                          source_key=source_key,
-                          target_path=path))
+                          source_key=source,
+                          target_path=target))
+        for source, target in downloads])
 
 
 @attributes([
@@ -272,15 +558,121 @@ class DownloadS3Key(object):
     """
 
 
+def _md5(path):
+    """
+    Compute the MD5 digest of a file.
+
+    :param FilePath path: The file to compute the digest of.
+
+    :return: A tuple of the hex and base64 encoded digests.
+    """
+    with path.open() as source_file:
+        hex_digest, base64_digest, _ = compute_md5(source_file)
+    return hex_digest, base64_digest
+
+
+def _multipart_etag(path, part_size):
+    """
+    Compute the ETag S3 gives a file uploaded in parts.
+
+    This is the MD5 digest of the concatenated MD5 digests of the parts,
+    followed by the number of parts.
+
+    :param FilePath path: The file to compute the ETag of.
+    :param int part_size: The size of each part but the last.
+
+    :return: The ETag, without quotes.
+    """
+    digests = []
+    with path.open() as source_file:
+        for part in iter(lambda: source_file.read(part_size), b''):
+            digests.append(md5(part).digest())
+    return '%s-%d' % (md5(b''.join(digests)).hexdigest(), len(digests))
+
+
+def _has_content(key, path):
+    """
+    Check whether an S3 key has the same content as a local file.
+
+    :param boto.s3.key.Key key: The key to compare.
+    :param FilePath path: The file to compare.
+
+    :return: ``True`` if the file exists and has the same size and ETag as
+        ``key``.  The ETag of a key uploaded in parts depends on the size of
+        the parts, so such keys only match if they were uploaded in parts of
+        ``S3_MULTIPART_PART_SIZE``, as ``UploadToS3`` does.
+    """
+    etag = key.etag.strip('"')
+    if not path.isfile() or path.getsize() != key.size:
+        return False
+    if '-' in etag:
+        return _multipart_etag(path, S3_MULTIPART_PART_SIZE) == etag
+    return _md5(path)[0] == etag
+
+
+# Files larger than this are transferred to and from S3 in parts.
+S3_MULTIPART_THRESHOLD = 5 * 1024 * 1024
+
+# The size of each part of a multipart transfer.
+S3_MULTIPART_PART_SIZE = 8 * 1024 * 1024
+
+# The number of parts of a single file to transfer concurrently.
+S3_MULTIPART_WORKERS = 4
+
+
+def _download_range(bucket_name, key_name, path, offset, size):
+    """
+    Download part of an S3 key into the corresponding part of a file.
+
+    :param bytes bucket_name: Name of the bucket being downloaded from.
+    :param bytes key_name: Name of the key being downloaded.
+    :param FilePath path: The file being downloaded to, which must already
+        be at least ``offset + size`` bytes long.
+    :param int offset: The offset in the key the part starts at.
+    :param int size: The size of the part.
+    """
+    s3 = _s3_connection()
+    key = s3.get_bucket(bucket_name, validate=False).new_key(key_name)
+    content = key.get_contents_as_string(
+        headers={'Range': 'bytes=%d-%d' % (offset, offset + size - 1)})
+    with path.open('r+') as target_file:
+        target_file.seek(offset)
+        target_file.write(content)
+
+
+def _download_multipart(key, path):
+    """
+    Download an S3 key in parts, downloading several parts concurrently.
+
+    :param boto.s3.key.Key key: The key to download.
+    :param FilePath path: The file to download to.
+    """
+    with path.open('w') as target_file:
+        target_file.truncate(key.size)
+    with ThreadPoolExecutor(max_workers=S3_MULTIPART_WORKERS) as pool:
+        parts = [
+            pool.submit(
+                _download_range, key.bucket.name, key.name, path, offset,
+                min(S3_MULTIPART_PART_SIZE, key.size - offset))
+            for offset in range(0, key.size, S3_MULTIPART_PART_SIZE)]
+    for part in parts:
+        part.result()
+
+
 @sync_performer
 def perform_download_s3_key(dispatcher, intent):
     """
     See :class:`DownloadS3Key`.
     """
-    s3 = boto.connect_s3()
+    s3 = _s3_connection()
 
     bucket = s3.get_bucket(intent.source_bucket)
     key = bucket.get_key(intent.source_key)
+    if _has_content(key, intent.target_path):
+        return
+    if key.size > S3_MULTIPART_THRESHOLD:
+        _download_multipart(key, intent.target_path)
+        return
     with intent.target_path.open('w') as target_file:
         key.get_contents_to_file(target_file)
 
@@ -310,16 +702,18 @@ def perform_upload_s3_key_recursively(dispatcher, intent):
     """
     See :class:`UploadToS3Recursively`.
     """
+    uploads = []
     for child in intent.files:
         path = intent.source_path.preauthChild(child)
         if path.isfile():
-            yield Effect(
+            uploads.append(Effect(
                 UploadToS3(
                     source_path=intent.source_path,
                     target_bucket=intent.target_bucket,
                     target_key="%s/%s" % (intent.target_key, child),
                     file=path,
-                    ))
+                    )))
+    yield parallel(uploads)
 
 
 @attributes([
@@ -341,20 +735,85 @@ class UploadToS3(object):
     """
 
 
+def _upload_part(bucket_name, key_name, upload_id, path, part_number, offset,
+                 size):
+    """
+    Upload one part of a multipart upload.
+
+    :param bytes bucket_name: Name of the bucket being uploaded to.
+    :param bytes key_name: Name of the key being uploaded.
+    :param bytes upload_id: The identifier of the multipart upload.
+    :param FilePath path: The file being uploaded.
+    :param int part_number: The number of the part, starting at 1.
+    :param int offset: The offset in the file the part starts at.
+    :param int size: The size of the part.
+    """
+    s3 = _s3_connection()
+    upload = MultiPartUpload(s3.get_bucket(bucket_name, validate=False))
+    upload.key_name = key_name
+    upload.id = upload_id
+    with path.open() as source_file:
+        source_file.seek(offset)
+        upload.upload_part_from_file(source_file, part_number, size=size)
+
+
+def _upload_multipart(bucket, key_name, path, headers):
+    """
+    Upload a file to S3 in parts, uploading several parts concurrently.
+
+    :param boto.s3.bucket.Bucket bucket: The bucket to upload to.
+    :param bytes key_name: Name of the key to upload to.
+    :param FilePath path: The file to upload.
+    :param dict headers: Headers to create the key with.
+    """
+    upload = bucket.initiate_multipart_upload(
+        key_name, headers=headers, policy='public-read')
+    file_size = path.getsize()
+    try:
+        with ThreadPoolExecutor(max_workers=S3_MULTIPART_WORKERS) as pool:
+            parts = [
+                pool.submit(
+                    _upload_part, bucket.name, key_name, upload.id, path,
+                    part_number, offset,
+                    min(S3_MULTIPART_PART_SIZE, file_size - offset))
+                for part_number, offset in enumerate(
+                    range(0, file_size, S3_MULTIPART_PART_SIZE), 1)]
+        for part in parts:
+            part.result()
+    except Exception:
+        upload.cancel_upload()
+        raise
+    upload.complete_upload()
+
+
 @sync_performer
 def perform_upload_s3_key(dispatcher, intent):
     """
     See :class:`UploadToS3`.
     """
-    s3 = boto.connect_s3()
+    s3 = _s3_connection()
     bucket = s3.get_bucket(intent.target_bucket)
+    # Don't upload the file again if it hasn't changed. Uploads make the key
+    # public though, so still make sure that the existing key is.
+    existing_key = bucket.get_key(intent.target_key)
+    if (
+        existing_key is not None and
+        intent.content_type in (None, existing_key.content_type) and
+        _has_content(existing_key, intent.file)
+    ):
+        existing_key.make_public()
+        return
     headers = {}
     if intent.content_type is not None:
         headers['Content-Type'] = intent.content_type
+    if intent.file.getsize() > S3_MULTIPART_THRESHOLD:
+        _upload_multipart(bucket, intent.target_key, intent.file, headers)
+        return
     with intent.file.open() as source_file:
         key = bucket.new_key(intent.target_key)
-        key.set_contents_from_file(source_file, headers=headers)
-        key.make_public()
+        key.set_contents_from_file(
+            source_file, headers=headers, md5=_md5(intent.file),
+            policy='public-read')
 
 boto_dispatcher = TypeDispatcher({
     UpdateS3RoutingRules: perform_update_s3_routing_rules,
@@ -367,6 +826,7 @@ boto_dispatcher = TypeDispatcher({
     UploadToS3Recursively: perform_upload_s3_key_recursively,
     UploadToS3: perform_upload_s3_key,
     CreateCloudFrontInvalidation: perform_create_cloudfront_invalidation,
+    ParallelEffects: perform_parallel_effects,
 })
 
 
@@ -406,7 +866,13 @@ class FakeAWS(object):
         """
         See :class:`UpdateS3RoutingRule`.
         """
+        old_routing_rules = self.routing_rules.get(
+            intent.bucket, RoutingRules())
         self.routing_rules[intent.bucket] = intent.routing_rules
+        if (isinstance(old_routing_rules, RoutingRules) and
+                _same_routing_rules(old_routing_rules, intent.routing_rules)):
+            return None
+        return old_routing_rules
 
     @sync_performer
     def _perform_update_s3_error_page(self, dispatcher, intent):
@@ -453,8 +919,9 @@ class FakeAWS(object):
         See :class:`ListS3Keys`.
         """
         bucket = self.s3_buckets[intent.bucket]
+        # Other effects may be changing the bucket concurrently.
         return {key[len(intent.prefix):]
-                for key in bucket
+                for key in list(bucket)
                 if key.startswith(intent.prefix)}
 
     @sync_performer
@@ -487,6 +954,7 @@ class FakeAWS(object):
             # Share implementation with real implementation
             DownloadS3KeyRecursively: perform_download_s3_key_recursively,
             UploadToS3Recursively: perform_upload_s3_key_recursively,
+            ParallelEffects: perform_parallel_effects,
 
             # Fake implementation
             UpdateS3RoutingRules: self._perform_update_s3_routing_rules,
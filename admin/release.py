@@ -15,13 +15,15 @@ import tempfile
 import virtualenv
 
 from datetime import datetime
+from functools import partial
+from itertools import imap
+from operator import add
 from subprocess import check_call
 
-from boto.s3.website import RoutingRules, RoutingRule
-
 from effect import (
-    Effect, sync_perform, ComposedDispatcher)
+    Effect, sync_perform, ComposedDispatcher, parallel)
 from effect.do import do
+from eliot import Field, MessageType
 
 from characteristic import attributes
 from git import GitCommandError, Repo
@@ -68,6 +70,18 @@ from .packaging import available_distributions, DISTRIBUTION_NAME_MAP
 
 DEV_ARCHIVE_BUCKET = 'clusterhq-dev-archive'
 
+# The number of ranges of keys to list concurrently when listing the
+# documentation buckets.
+S3_LISTING_PARALLELISM = 8
+
+# The fraction of the paths under a documentation prefix that must change for
+# the CloudFront invalidation to cover the whole prefix with a wildcard.
+INVALIDATION_COALESCE_THRESHOLD = 0.5
+
+# The directory, under the system temporary directory, that createrepo caches
+# package checksums in between releases.
+CREATEREPO_CACHE_DIRECTORY = b'flocker-createrepo-cache'
+
 
 class NotTagged(Exception):
     """
@@ -162,6 +176,9 @@ def parse_routing_rules(routing_config, hostname):
     :return: Parsed routing rules.
     :rtype: ``boto.s3.website.RoutingRules``
     """
+    # boto is otherwise only used via ``admin.aws``, so only import it here
+    # when routing rules are actually needed.
+    from boto.s3.website import RoutingRules, RoutingRule
     rules = []
     for prefix, relative_redirects in routing_config.items():
         for postfix, destination in relative_redirects.items():
@@ -184,6 +201,40 @@ def parse_routing_rules(routing_config, hostname):
     )
 
 
+def coalesce_paths(paths, prefix_sizes, threshold=0.5):
+    """
+    Replace the paths under a prefix with a single wildcard path covering the
+    whole prefix, if most of the prefix has changed.
+
+    CloudFront limits the number of paths that can be invalidated at once and
+    charges per path, whereas a wildcard path counts as a single path.
+
+    :param set paths: The paths to invalidate.
+    :param dict prefix_sizes: Mapping from each prefix that may be coalesced
+        to an estimate of the number of paths under it.
+    :param float threshold: The fraction of the paths under a prefix that must
+        be changed for the prefix to be coalesced.
+
+    :return: A ``set`` of paths covering the given ``paths``.
+    """
+    coalesced = set(paths)
+    for prefix, size in prefix_sizes.items():
+        changed = {path for path in coalesced if path.startswith(prefix)}
+        if changed and len(changed) > threshold * size:
+            coalesced -= changed
+            coalesced.add(prefix + '*')
+    return coalesced
+
+
+_LOG_NO_OP_PUBLISH = MessageType(
+    "admin:release:publish_docs:no_op_publish",
+    [Field.for_types("doc_version", [bytes, unicode],
+                     "The version the documentation was published as.")],
+    "No-op publish: neither the documentation nor the routing rules changed, "
+    "so no CloudFront invalidation was created.",
+)
+
+
 @do
 def publish_docs(flocker_version, doc_version, environment, routing_config):
     """
@@ -228,46 +279,47 @@ def publish_docs(flocker_version, doc_version, environment, routing_config):
     # Get the list of keys in the new documentation.
     new_version_keys = yield Effect(
         ListS3Keys(bucket=configuration.dev_bucket,
-                   prefix=dev_prefix))
-
-    # Get the list of keys already existing for the given version.
-    # This should only be non-empty for documentation releases.
-    existing_version_keys = yield Effect(
-        ListS3Keys(bucket=configuration.documentation_bucket,
-                   prefix=version_prefix))
-
-    existing_latest_keys = yield Effect(
-        ListS3Keys(bucket=configuration.documentation_bucket,
-                   prefix=stable_prefix))
+                   prefix=dev_prefix,
+                   parallelism=S3_LISTING_PARALLELISM))
 
     # Copy the new documentation to the documentation bucket at the
-    # versioned prefix, i.e. en/x.y.z
-    yield Effect(
-        CopyS3Keys(source_bucket=configuration.dev_bucket,
-                   source_prefix=dev_prefix,
-                   destination_bucket=configuration.documentation_bucket,
-                   destination_prefix=version_prefix,
-                   keys=new_version_keys))
-
-    # Copy the new documentation to the documentation bucket at the
-    # stable prefix, e.g. en/latest
-    yield Effect(
-        CopyS3Keys(source_bucket=configuration.dev_bucket,
-                   source_prefix=dev_prefix,
-                   destination_bucket=configuration.documentation_bucket,
-                   destination_prefix=stable_prefix,
-                   keys=new_version_keys))
-
-    # Delete any keys that aren't in the new documentation.
-    yield Effect(
-        DeleteS3Keys(bucket=configuration.documentation_bucket,
-                     prefix=version_prefix,
-                     keys=existing_version_keys - new_version_keys))
-
-    yield Effect(
-        DeleteS3Keys(bucket=configuration.documentation_bucket,
-                     prefix=stable_prefix,
-                     keys=existing_latest_keys - new_version_keys))
+    # versioned prefix, i.e. en/x.y.z, and at the stable prefix, e.g.
+    # en/latest.
+    # At the same time, get the list of keys already existing for the given
+    # version (this should only be non-empty for documentation releases) and
+    # the list of keys under the stable prefix. These listings may include
+    # some of the keys being copied, but those are never deleted and are
+    # already among the changed keys, so the listings don't need to wait for
+    # the copies.
+    copies = [
+        Effect(
+            CopyS3Keys(source_bucket=configuration.dev_bucket,
+                       source_prefix=dev_prefix,
+                       destination_bucket=configuration.documentation_bucket,
+                       destination_prefix=prefix,
+                       keys=new_version_keys))
+        for prefix in [version_prefix, stable_prefix]]
+    listings = [
+        Effect(ListS3Keys(bucket=configuration.documentation_bucket,
+                          prefix=prefix,
+                          parallelism=S3_LISTING_PARALLELISM))
+        for prefix in [version_prefix, stable_prefix]]
+    results = yield parallel(copies + listings)
+    existing_version_keys, existing_latest_keys = results[len(copies):]
+
+    # Delete any keys that aren't in the new documentation. Skip the requests
+    # for prefixes that have nothing to delete.
+    stale_keys = {
+        version_prefix: existing_version_keys - new_version_keys,
+        stable_prefix: existing_latest_keys - new_version_keys,
+    }
+    yield parallel([
+        Effect(
+            DeleteS3Keys(bucket=configuration.documentation_bucket,
+                         prefix=prefix,
+                         keys=keys))
+        for prefix, keys in stale_keys.items()
+        if keys])
 
     # Update the key used for error pages if we're publishing to staging or if
     # we're publishing a marketing release to production.
@@ -286,25 +338,44 @@ def publish_docs(flocker_version, doc_version, environment, routing_config):
     # S3 serves /index.html when given /, so any changed /index.html means
     # that / changed as well.
     # Note that we check for '/index.html' but remove 'index.html'
-    changed_keys |= {key_name[:-len('index.html')]
-                     for key_name in changed_keys
-                     if key_name.endswith('/index.html')}
+    index_length = len('index.html')
+    changed_keys.update([key_name[:-index_length]
+                         for key_name in changed_keys
+                         if key_name.endswith('/index.html')])
 
     # Always update the root.
-    changed_keys |= {''}
+    changed_keys.add('')
 
     # The full paths are all the changed keys under the stable prefix, and
     # the new version prefix. This set is slightly bigger than necessary.
-    changed_paths = {prefix + key_name
-                     for key_name in changed_keys
-                     for prefix in [stable_prefix, version_prefix]}
-
-    yield Effect(UpdateS3RoutingRules(
+    # There may be many thousands of keys, so add the prefixes without a
+    # Python-level loop.
+    changed_paths = set(imap(partial(add, stable_prefix), changed_keys))
+    changed_paths.update(imap(partial(add, version_prefix), changed_keys))
+
+    # Invalidate whole prefixes rather than every path under them, if most of
+    # their contents changed. The listings made above give the number of keys
+    # under each prefix.
+    changed_paths = coalesce_paths(
+        changed_paths, {
+            stable_prefix: len(existing_latest_keys | new_version_keys),
+            version_prefix: len(existing_version_keys | new_version_keys),
+        },
+        threshold=INVALIDATION_COALESCE_THRESHOLD)
+
+    old_routing_rules = yield Effect(UpdateS3RoutingRules(
         bucket=configuration.documentation_bucket,
         routing_rules=parse_routing_rules(
             routing_config, configuration.cloudfront_cname),
     ))
 
+    # If the only changed key is the root, which is always added above, and
+    # the routing rules didn't change either, then nothing that needs
+    # invalidating changed.
+    if changed_keys == {''} and old_routing_rules is None:
+        _LOG_NO_OP_PUBLISH(doc_version=doc_version).write()
+        return
+
     # Invalidate all the changed paths in cloudfront.
     yield Effect(
         CreateCloudFrontInvalidation(cname=configuration.cloudfront_cname,
@@ -415,7 +486,7 @@ FLOCKER_PACKAGES = [
 
 @do
 def update_repo(package_directory, target_bucket, target_key, source_repo,
-                packages, flocker_version, distribution):
+                packages, flocker_version, distribution, cache_directory=None):
     """
     Update ``target_bucket`` yum repository with ``packages`` from
     ``source_repo`` repository.
@@ -431,6 +502,8 @@ def update_repo(package_directory, target_bucket, target_key, source_repo,
     :param bytes flocker_version: The version of flocker to upload packages
         for.
     :param Distribution distribution: The distribution to upload packages for.
+    :param FilePath cache_directory: Directory to cache repository metadata
+        in between releases, or ``None`` to not cache it.
     """
     package_directory.createDirectory()
 
@@ -453,6 +526,7 @@ def update_repo(package_directory, target_bucket, target_key, source_repo,
     new_metadata = yield Effect(CreateRepo(
         repository_path=package_directory,
         distribution=distribution,
+        cache_path=cache_directory,
         ))
 
     yield Effect(UploadToS3Recursively(
@@ -465,7 +539,7 @@ def update_repo(package_directory, target_bucket, target_key, source_repo,
 
 @do
 def upload_packages(scratch_directory, target_bucket, version, build_server,
-                    top_level):
+                    top_level, cache_directory=None):
     """
     The ClusterHQ yum and deb repositories contain packages for Flocker, as
     well as the dependencies which aren't available in CentOS 7. It is
@@ -480,21 +554,28 @@ def upload_packages(scratch_directory, target_bucket, version, build_server,
     :param bytes version: Version to download packages for.
     :param bytes build_server: Server to download new packages from.
     :param FilePath top_level: The top-level of the flocker repository.
+    :param FilePath cache_directory: Directory to cache repository metadata
+        in between releases, or ``None`` to not cache it.
     """
     distribution_names = available_distributions(
         flocker_source_path=top_level,
     )
 
+    # The repositories for each distribution are independent, so update them
+    # concurrently.
+    updates = []
     for distribution_name in distribution_names:
         distribution = DISTRIBUTION_NAME_MAP[distribution_name]
         architecture = distribution.native_package_architecture()
+        repository_name = b'{}-{}-{}'.format(
+            distribution.name, distribution.version, architecture)
+        if cache_directory is None:
+            repository_cache = None
+        else:
+            repository_cache = cache_directory.child(repository_name)
 
-        yield update_repo(
-            package_directory=scratch_directory.child(
-                b'{}-{}-{}'.format(
-                    distribution.name,
-                    distribution.version,
-                    architecture)),
+        updates.append(update_repo(
+            package_directory=scratch_directory.child(repository_name),
             target_bucket=target_bucket,
             target_key=os.path.join(
                 distribution.name + get_package_key_suffix(version),
@@ -507,7 +588,10 @@ def upload_packages(scratch_directory, target_bucket, version, build_server,
             packages=FLOCKER_PACKAGES,
             flocker_version=version,
             distribution=distribution,
-        )
+            cache_directory=repository_cache,
+        ))
+
+    yield parallel(updates)
 
 
 packages_template = (
@@ -650,6 +734,8 @@ def publish_artifacts_main(args, base_path, top_level):
                     version=options['flocker-version'],
                     build_server=options['build-server'],
                     top_level=top_level,
+                    cache_directory=FilePath(tempfile.gettempdir()).child(
+                        CREATEREPO_CACHE_DIRECTORY),
                 ),
                 upload_python_packages(
                     scratch_directory=scratch_directory.child('python'),
@@ -0,0 +1,153 @@
+# Copyright ClusterHQ Inc.  See LICENSE file for details.
+
+"""
+Tests for ``admin.aws``.
+"""
+
+from hashlib import md5
+
+from boto.s3.key import Key
+from effect import (
+    ComposedDispatcher, Constant, Effect, Error, FirstError, base_dispatcher,
+    parallel, sync_perform,
+)
+
+from .. import aws
+from ..aws import (
+    S3_MULTIPART_THRESHOLD, _chunks, _has_content, _split_markers,
+    boto_dispatcher,
+)
+
+from flocker.testtools import TestCase
+
+
+class SplitMarkersTests(TestCase):
+    """
+    Tests for ``_split_markers``.
+    """
+    def test_single_range(self):
+        """
+        A parallelism of one gives a single unbounded range.
+        """
+        self.assertEqual([None, None], _split_markers('en/', 1))
+
+    def test_ranges(self):
+        """
+        The printable characters following the prefix are split evenly
+        between the ranges, and the outermost markers are unbounded.
+        """
+        self.assertEqual([None, 'en/8', 'en/P', 'en/g', None],
+                         _split_markers('en/', 4))
+
+    def test_parallelism_capped(self):
+        """
+        The key space is never split into more ranges than there are
+        characters to split on.
+        """
+        markers = _split_markers('', 1000)
+        self.assertEqual(len(set(markers[1:-1])), len(markers) - 2)
+
+
+class ChunksTests(TestCase):
+    """
+    Tests for ``_chunks``.
+    """
+    def test_chunks(self):
+        """
+        Items are split into consecutive lists of at most ``size`` items.
+        """
+        self.assertEqual([[0, 1], [2, 3], [4]], _chunks(range(5), 2))
+
+    def test_empty(self):
+        """
+        No items gives no chunks.
+        """
+        self.assertEqual([], _chunks([], 2))
+
+
+class PerformParallelEffectsTests(TestCase):
+    """
+    Tests for ``perform_parallel_effects``.
+    """
+    dispatcher = ComposedDispatcher([boto_dispatcher, base_dispatcher])
+
+    def test_results(self):
+        """
+        The results of the child effects are returned in order.
+        """
+        self.assertEqual(
+            [1, 2, 3],
+            sync_perform(
+                self.dispatcher,
+                parallel([Effect(Constant(1)), Effect(Constant(2)),
+                          Effect(Constant(3))])))
+
+    def test_error(self):
+        """
+        If a child effect fails, a ``FirstError`` wrapping the failure is
+        raised.
+        """
+        error = self.assertRaises(
+            FirstError,
+            sync_perform,
+            self.dispatcher,
+            parallel([Effect(Constant(1)),
+                      Effect(Error(ValueError("oops")))]))
+        self.assertEqual((1, ValueError), (error.index, error.exc_info[0]))
+
+
+class HasContentTests(TestCase):
+    """
+    Tests for ``_has_content``.
+    """
+    def key(self, etag, size):
+        """
+        Create a ``Key`` as returned by ``Bucket.get_key``.
+        """
+        key = Key()
+        key.etag = '"%s"' % (etag,)
+        key.size = size
+        return key
+
+    def test_content(self):
+        """
+        A key has the content of a file with the same size and MD5 digest.
+        """
+        content = b'content'
+        path = self.make_temporary_file(content)
+        self.assertTrue(
+            _has_content(self.key(md5(content).hexdigest(), 7), path))
+
+    def test_other_content(self):
+        """
+        A key does not have the content of a file of the same size with a
+        different MD5 digest.
+        """
+        path = self.make_temporary_file(b'content')
+        self.assertFalse(
+            _has_content(self.key(md5(b'CONTENT').hexdigest(), 7), path))
+
+    def test_multipart_content(self):
+        """
+        A key uploaded in parts has the content of a file larger than
+        ``S3_MULTIPART_THRESHOLD`` whose parts have the same MD5 digests.
+        """
+        content = b'x' * (S3_MULTIPART_THRESHOLD + 1)
+        path = self.make_temporary_file(content)
+        etag = '%s-1' % (md5(md5(content).digest()).hexdigest(),)
+        self.assertTrue(_has_content(self.key(etag, len(content)), path))
+
+    def test_multipart_parts(self):
+        """
+        The ETag of a key uploaded in parts is compared with the digests of
+        parts of ``S3_MULTIPART_PART_SIZE``.
+        """
+        self.patch(aws, 'S3_MULTIPART_PART_SIZE', 4)
+        path = self.make_temporary_file(b'abcdefghij')
+        etag = '%s-3' % (md5(b''.join(
+            md5(part).digest() for part in (b'abcd', b'efgh', b'ij')
+        )).hexdigest(),)
+        self.assertEqual(
+            [True, False],
+            [_has_content(self.key(etag, 10), path),
+             _has_content(self.key(etag.replace('-3', '-2'), 10), path)])
@@ -14,6 +14,7 @@ from textwrap import dedent
 from unittest import skipUnless, skipIf
 
 from effect import sync_perform, ComposedDispatcher, base_dispatcher
+from eliot.testing import capture_logging, assertHasMessage
 from git import Repo
 
 from hypothesis import given
@@ -27,14 +28,16 @@ from twisted.python.filepath import FilePath
 from twisted.python.procutils import which
 from twisted.python.usage import UsageError
 
+from .. import release
 from ..release import (
+    coalesce_paths,
     upload_python_packages, upload_packages, update_repo,
     parse_routing_rules, publish_docs, Environments,
     DocumentationRelease, DOCUMENTATION_CONFIGURATIONS, NotTagged, NotARelease,
     calculate_base_branch, create_release_branch,
     CreateReleaseBranchOptions, BranchExists, TagExists,
     UploadOptions, create_pip_index, upload_pip_index,
-    update_license_file,
+    update_license_file, _LOG_NO_OP_PUBLISH,
 )
 
 from ..packaging import Distribution
@@ -174,6 +177,48 @@ class ParseRoutingRulesTests(TestCase):
         ]))
 
 
+class CoalescePathsTests(TestCase):
+    """
+    Tests for :func:`coalesce_paths`.
+    """
+    def test_below_threshold(self):
+        """
+        Paths under a prefix are left alone if no more than ``threshold`` of
+        the paths under it changed.
+        """
+        paths = {'en/latest/', 'en/latest/index.html'}
+        self.assertEqual(
+            paths,
+            coalesce_paths(paths, {'en/latest/': 4}, threshold=0.5))
+
+    def test_above_threshold(self):
+        """
+        Paths under a prefix are replaced with a single wildcard path if more
+        than ``threshold`` of the paths under it changed.
+        """
+        self.assertEqual(
+            {'en/latest/*'},
+            coalesce_paths({'en/latest/', 'en/latest/index.html'},
+                           {'en/latest/': 3}, threshold=0.5))
+
+    def test_other_paths(self):
+        """
+        Paths which aren't under any of the given prefixes are left alone.
+        """
+        self.assertEqual(
+            {'en/latest/*', 'en/0.3.1/index.html'},
+            coalesce_paths({'en/latest/index.html', 'en/0.3.1/index.html'},
+                           {'en/latest/': 1}))
+
+    def test_unchanged_prefix(self):
+        """
+        No wildcard path is added for a prefix with no changed paths.
+        """
+        self.assertEqual(
+            {'en/0.3.1/index.html'},
+            coalesce_paths({'en/0.3.1/index.html'}, {'en/latest/': 0}))
+
+
 class PublishDocsTests(TestCase):
     """
     Tests for :func:``publish_docs``.
@@ -196,6 +241,13 @@ class PublishDocsTests(TestCase):
                          environment=environment,
                          routing_config=routing_config))
 
+    def invalidate_individual_paths(self):
+        """
+        Make :func:`publish_docs` invalidate each changed path, rather than
+        coalescing them into a wildcard path for each prefix.
+        """
+        self.patch(release, 'INVALIDATION_COALESCE_THRESHOLD', float('inf'))
+
     def test_copies_documentation(self):
         """
         Calling :func:`publish_docs` copies documentation from
@@ -403,6 +455,7 @@ class PublishDocsTests(TestCase):
         - en/<doc_version>/
         each for every path in the new documentation for <doc_version>.
         """
+        self.invalidate_individual_paths()
         aws = FakeAWS(
             routing_rules={
             },
@@ -443,6 +496,7 @@ class PublishDocsTests(TestCase):
         Calling :func:`publish_docs` with a release or documentation version
         doesn't creates an invalidation for files that end in ``index.html``.
         """
+        self.invalidate_individual_paths()
         aws = FakeAWS(
             routing_rules={
             },
@@ -476,6 +530,7 @@ class PublishDocsTests(TestCase):
         - en/<doc_version>/
         each for every path in the old documentation for <doc_version>.
         """
+        self.invalidate_individual_paths()
         aws = FakeAWS(
             routing_rules={
             },
@@ -515,6 +570,7 @@ class PublishDocsTests(TestCase):
         each for every path in the documentation for version that was
         previously `en/latest/`.
         """
+        self.invalidate_individual_paths()
         aws = FakeAWS(
             routing_rules={
             },
@@ -555,6 +611,7 @@ class PublishDocsTests(TestCase):
         - en/<doc_version>/
         each for every path in the new documentation for <doc_version>.
         """
+        self.invalidate_individual_paths()
         aws = FakeAWS(
             routing_rules={
                 'clusterhq-staging-docs': {
@@ -601,6 +658,7 @@ class PublishDocsTests(TestCase):
         - en/<doc_version>/
         each for every path in the old documentation for <doc_version>.
         """
+        self.invalidate_individual_paths()
         aws = FakeAWS(
             routing_rules={
             },
@@ -640,6 +698,7 @@ class PublishDocsTests(TestCase):
         each for every path in the documentation for version that was
         previously `en/devel/`.
         """
+        self.invalidate_individual_paths()
         aws = FakeAWS(
             routing_rules={
             },
@@ -677,6 +736,7 @@ class PublishDocsTests(TestCase):
         Calling :func:`publish_docs` in production creates an invalidation for
         ``docs.clusterhq.com``.
         """
+        self.invalidate_individual_paths()
         aws = FakeAWS(
             routing_rules={
             },
@@ -708,6 +768,86 @@ class PublishDocsTests(TestCase):
                     }),
             ])
 
+    def test_creates_cloudfront_invalidation_coalesced(self):
+        """
+        Calling :func:`publish_docs` creates an invalidation for a wildcard
+        path under each of ``en/latest/`` and ``en/<doc_version>/`` when most
+        of the paths under them changed.
+        """
+        aws = FakeAWS(
+            routing_rules={
+            },
+            s3_buckets={
+                'clusterhq-staging-docs': {
+                    'index.html': '',
+                    'en/index.html': '',
+                    'en/latest/index.html': '',
+                    'en/0.3.1/index.html': '',
+                    'release/flocker-0.3.0+444.gf05215b/index.html': '',
+                    'release/flocker-0.3.0+444.gf05215b/sub/index.html': '',
+                    'release/flocker-0.3.0+444.gf05215b/sub/other.html': '',
+                },
+            })
+        self.publish_docs(aws, '0.3.0+444.gf05215b', '0.3.1',
+                          environment=Environments.STAGING)
+        self.assertEqual(
+            aws.cloudfront_invalidations, [
+                CreateCloudFrontInvalidation(
+                    cname='docs.staging.clusterhq.com',
+                    paths={
+                        'en/latest/*',
+                        'en/0.3.1/*',
+                    }),
+            ])
+
+    @capture_logging(None)
+    def test_no_cloudfront_invalidation_without_changes(self, logger):
+        """
+        Calling :func:`publish_docs` doesn't create an invalidation, and logs
+        a no-op publish, if only the root changed and the routing rules are
+        unchanged.
+        """
+        aws = FakeAWS(
+            routing_rules={
+            },
+            s3_buckets={
+                'clusterhq-staging-docs': {
+                    'index.html': '',
+                    'en/index.html': '',
+                },
+            })
+        self.publish_docs(aws, '0.3.0+444.gf05215b', '0.3.1',
+                          environment=Environments.STAGING)
+        self.assertEqual(aws.cloudfront_invalidations, [])
+        assertHasMessage(self, logger, _LOG_NO_OP_PUBLISH,
+                         {'doc_version': '0.3.1'})
+
+    def test_cloudfront_invalidation_routing_rules_changed(self):
+        """
+        Calling :func:`publish_docs` creates an invalidation if the routing
+        rules changed, even if only the root changed otherwise.
+        """
+        aws = FakeAWS(
+            routing_rules={
+            },
+            s3_buckets={
+                'clusterhq-staging-docs': {
+                    'index.html': '',
+                    'en/index.html': '',
+                },
+            })
+        self.publish_docs(aws, '0.3.0+444.gf05215b', '0.3.1',
+                          environment=Environments.STAGING,
+                          routing_config={
+                              "prefix/": {"key/": {"replace_key": "replace"}},
+                          })
+        self.assertEqual(
+            aws.cloudfront_invalidations, [
+                CreateCloudFrontInvalidation(
+                    cname='docs.staging.clusterhq.com',
+                    paths={'en/latest/*', 'en/0.3.1/*'}),
+            ])
+
     def test_production_gets_tagged_version(self):
         """
         Trying to publish to production, when the version being pushed isn't
@@ -4,9 +4,13 @@
 Effectful interface to packaging tools.
 """
 
+import threading
+from multiprocessing import cpu_count
+from concurrent.futures import ThreadPoolExecutor
+
 import requests
 from requests_file import FileAdapter
-from characteristic import attributes
+from characteristic import attributes, Attribute
 from effect import sync_performer, TypeDispatcher
 from subprocess import check_call
 from gzip import GzipFile
@@ -20,6 +24,9 @@ from admin.packaging import (
     package_filename,
 )
 
+# Size of the chunks packages are written to disk in.
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
 
 @attributes([
     "source_repo",
@@ -42,6 +49,40 @@ class DownloadPackagesFromRepository(object):
     """
 
 
+_sessions = threading.local()
+
+
+def _requests_session():
+    """
+    Get a ``requests.Session`` for the current thread.
+
+    Reusing the session between repositories avoids setting it up again, and
+    lets it keep its connections to the build server open.
+
+    :return: A ``requests.Session``.
+    """
+    session = getattr(_sessions, 'session', None)
+    if session is None:
+        session = _sessions.session = requests.Session()
+        # Tests use a local package repository
+        session.mount('file://', FileAdapter())
+    return session
+
+
+def _download_package(url, local_path):
+    """
+    Download a package, streaming it to disk.
+
+    :param bytes url: The URL of the package.
+    :param bytes local_path: The path to write the package to.
+    """
+    download = _requests_session().get(url, stream=True)
+    download.raise_for_status()
+    with open(local_path, "wb") as local_file:
+        for chunk in download.iter_content(DOWNLOAD_CHUNK_SIZE):
+            local_file.write(chunk)
+
+
 @sync_performer
 def perform_download_packages_from_repository(dispatcher, intent):
     """
@@ -50,33 +91,38 @@ def perform_download_packages_from_repository(dispatcher, intent):
     rpm_version = make_rpm_version(intent.flocker_version)
 
     package_type = intent.distribution.package_type()
-    s = requests.Session()
-    # Tests use a local package repository
-    s.mount('file://', FileAdapter())
 
-    downloaded_packages = set()
-    for package in intent.packages:
-        package_name = package_filename(
+    package_names = [
+        package_filename(
             package_type=package_type,
             package=package,
             architecture=PACKAGE_ARCHITECTURE[package],
             rpm_version=rpm_version,
         )
-        url = intent.source_repo + '/' + package_name
-        local_path = intent.target_path.child(package_name).path
-        download = s.get(url)
-        download.raise_for_status()
-        content = download.content
-        with open(local_path, "wb") as local_file:
-            local_file.write(content)
-        downloaded_packages.add(package_name)
-
-    return downloaded_packages
+        for package in intent.packages
+    ]
+    if not package_names:
+        return set()
+
+    # Only a handful of packages are needed, so fetch them all at once.
+    with ThreadPoolExecutor(max_workers=len(package_names)) as pool:
+        downloads = [
+            pool.submit(
+                _download_package,
+                intent.source_repo + '/' + package_name,
+                intent.target_path.child(package_name).path)
+            for package_name in package_names
+        ]
+    for download in downloads:
+        download.result()
+
+    return set(package_names)
 
 
 @attributes([
     "repository_path",
     "distribution",
+    Attribute("cache_path", default_value=None),
 ])
 class CreateRepo(object):
     """
@@ -87,6 +133,8 @@ class CreateRepo(object):
         repository from.
     :param Distribution distribution: The distribution to create a repository
         for.
+    :ivar FilePath cache_path: Directory to cache package checksums in
+        between runs, or ``None`` to not cache them.
 
     :return: List of new and modified package metadata filenames.
     """
@@ -100,10 +148,16 @@ def perform_create_repository(dispatcher, intent):
     package_type = intent.distribution.package_type()
 
     if package_type == PackageTypes.RPM:
-        check_call([
+        # Packages are hashed in parallel, and the checksums of packages
+        # which haven't changed since a previous run are reused.
+        command = [
             b'createrepo',
             b'--quiet',
-            intent.repository_path.path])
+            b'--workers', b'%d' % (cpu_count(),),
+        ]
+        if intent.cache_path is not None:
+            command.extend([b'--cachedir', intent.cache_path.path])
+        check_call(command + [intent.repository_path.path])
         return _list_new_metadata(repository_path=intent.repository_path)
     elif package_type == PackageTypes.DEB:
         packages_file = intent.repository_path.child('Packages')
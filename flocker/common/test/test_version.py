@@ -44,6 +44,7 @@ class MakeRpmVersionTests(TestCase):
             '0.1.1rc1': RPMVersion(version='0.1.1', release='0.rc.1'),
             '0.1.1': RPMVersion(version='0.1.1', release='1'),
             '0.2.0.dev1': RPMVersion(version='0.2.0', release='0.dev.1'),
+            '0.2.0rc1.dev2': RPMVersion(version='0.2.0', release='0.dev.2'),
             '0.2.0.dev2+99.g3d644b1':
                 RPMVersion(version='0.2.0', release='0.dev.2.99.g3d644b1'),
             '0.2.0.dev3+100.g3d644b2.dirty': RPMVersion(
@@ -7,6 +7,13 @@ from characteristic import attributes, Attribute
 
 from pyrsistent import PClass, field
 
+from repoze.lru import lru_cache
+
+
+# The version helpers below are pure functions of short strings which are
+# called repeatedly with the same handful of versions, so their results are
+# cached.
+_VERSION_CACHE_SIZE = 1024
 
 # This regex parses valid version numbers for Flocker. It handles two
 # versioning schemes (legacy and PEP440 compliant). In particular, it
@@ -117,6 +124,7 @@ def parse_version(version):
     return FlockerVersion(**parts)
 
 
+@lru_cache(_VERSION_CACHE_SIZE)
 def get_doc_version(version):
     """
     Get the version string of Flocker to display in documentation.
@@ -140,6 +148,7 @@ def get_installable_version(version):
     return parsed_version.installable_release
 
 
+@lru_cache(_VERSION_CACHE_SIZE)
 def is_release(version):
     """
     Return whether the version corresponds to a marketing or documentation
@@ -158,6 +167,7 @@ def is_release(version):
     )
 
 
+@lru_cache(_VERSION_CACHE_SIZE)
 def is_weekly_release(version):
     """
     Return whether the version corresponds to a weekly release.
@@ -174,6 +184,7 @@ def is_weekly_release(version):
     )
 
 
+@lru_cache(_VERSION_CACHE_SIZE)
 def is_pre_release(version):
     """
     Return whether the version corresponds to a pre-release.
@@ -251,6 +262,7 @@ class RPMVersion(PClass):
     release = field(mandatory=True)
 
 
+@lru_cache(_VERSION_CACHE_SIZE)
 def make_rpm_version(flocker_version):
     """
     Parse the Flocker version generated by versioneer into a
@@ -260,16 +272,19 @@ def make_rpm_version(flocker_version):
     :return: An ``RPMVersion``.
     """
     parsed_version = parse_version(flocker_version)
-    installable = parsed_version.installable_release
 
     # Given pre or dev number X create a 0 prefixed, `.` separated
     # string of version labels. E.g.
     # 0.1.2rc2  becomes
     # 0.1.2-0.rc.2
-    if is_pre_release(installable):
-        release = ['0', 'rc', parsed_version.pre_release]
-    elif is_weekly_release(installable):
+    # The weekly release takes precedence, as it does for
+    # ``FlockerVersion.installable_release``. This is decided from the
+    # already parsed version, rather than parsing the installable release
+    # again.
+    if parsed_version.weekly_release is not None:
         release = ['0', 'dev', parsed_version.weekly_release]
+    elif parsed_version.pre_release is not None:
+        release = ['0', 'rc', parsed_version.pre_release]
     else:
         release = ['1']
 
@@ -7,12 +7,15 @@ for computing the difference between deeply pyrsisistent objects such as the
 flocker configuration or the flocker state.
 """
 
+from weakref import WeakValueDictionary
+
 from eliot import MessageType, Field
 
 from pyrsistent import (
     PClass,
     PMap,
     PSet,
+    PVector,
     field,
     pvector,
     pvector_field,
@@ -78,7 +81,8 @@ class _Remove(PClass):
     item = field()
 
     def apply(self, obj):
-        return obj.transform(self.path, lambda o: o.remove(self.item))
+        obj.target(self.path).remove(self.item)
+        return obj
 
 
 @implementer(_IDiffChange)
@@ -96,9 +100,8 @@ class _Set(PClass):
     value = field()
 
     def apply(self, obj):
-        return obj.transform(
-            self.path, lambda o: o.set(self.key, self.value)
-        )
+        obj.target(self.path).set(self.key, self.value)
+        return obj
 
 
 @implementer(_IDiffChange)
@@ -114,12 +117,93 @@ class _Add(PClass):
     item = field()
 
     def apply(self, obj):
-        return obj.transform(self.path, lambda x: x.add(self.item))
+        obj.target(self.path).add(self.item)
+        return obj
 
 
 _sentinel = object()
 
 
+# Changes that are currently in use, keyed by their type and the ``_typed``
+# keys of their path and other fields.  See ``_interned``.
+_INTERNED_CHANGES = WeakValueDictionary()
+
+# The paths of the changes that are currently in use, keyed by the ``_typed``
+# key of the path.  See ``_interned``.
+_INTERNED_PATHS = WeakValueDictionary()
+
+
+def _typed(value):
+    """
+    Get a key for a value that includes the types of the value and of all of
+    the values nested inside it.
+
+    Equal values of different types (e.g. ``1`` and ``True``, or ``u'x'`` and
+    ``b'x'``), or which contain such values at any depth, have different
+    keys.
+
+    :param value: The value to get a key for.
+
+    :returns: A key which is only equal to the key of another value if the
+        values are equal and of the same types all the way down.
+    """
+    if isinstance(value, PClass):
+        parts = frozenset(
+            (name, _typed(part)) for name, part in value._to_dict().items()
+        )
+    elif isinstance(value, (PMap, dict)):
+        parts = frozenset(
+            (_typed(key), _typed(part)) for key, part in value.items()
+        )
+    elif isinstance(value, (PSet, set, frozenset)):
+        parts = frozenset(_typed(part) for part in value)
+    elif isinstance(value, (PVector, list, tuple)):
+        parts = tuple(_typed(part) for part in value)
+    else:
+        parts = value
+    return (type(value), parts)
+
+
+def _interned(change_type, path, **fields):
+    """
+    Get a change, reusing an existing equal change if there is one.
+
+    The same changes are computed over and over again when the same
+    configuration or state changes are reported repeatedly.  Sharing them
+    avoids constructing them again, and saves memory in diffs that are kept
+    around.  Changes are only kept while something else refers to them.
+
+    :param type change_type: The ``_IDiffChange`` to create.
+    :param tuple path: The path of the change.
+    :param fields: The other fields of the change.
+
+    :returns: An instance of ``change_type`` with the given fields.
+    """
+    # Equal values of different types must not share a change, or applying
+    # it would change the type of the value.  So the keys include the types
+    # of the path elements and of the values, all the way down.
+    path_key = _typed(tuple(path))
+    # Changes at the same path share the converted path too, so that it is
+    # only converted once and applying consecutive changes to the same path
+    # can compare the paths by identity.
+    path_vector = _INTERNED_PATHS.get(path_key, path)
+    key = (change_type, path_key) + tuple(
+        (name, _typed(value))
+        for name, value in sorted(fields.items())
+    )
+    try:
+        change = _INTERNED_CHANGES.get(key)
+    except TypeError:
+        # Changes to unhashable values can't be shared.
+        change = change_type(path=path_vector, **fields)
+    else:
+        if change is None:
+            change = change_type(path=path_vector, **fields)
+            _INTERNED_CHANGES[key] = change
+    _INTERNED_PATHS[path_key] = change.path
+    return change
+
+
 class _IEvolvable(Interface):
     """
     An interface to mark classes that provide a ``Pyrsistent`` style
@@ -180,7 +264,8 @@ class _IRecursiveEvolverProxy(Interface):
         "Must provide ``_IEvolvable``"
     )
     _children = Attribute(
-        "A collection of child ``_IRecursiveEvolverProxy`` objects."
+        "A collection of child ``_IRecursiveEvolverProxy`` objects, or "
+        "``None`` if no children have been created yet."
     )
 
     def commit():
@@ -198,13 +283,33 @@ class _EvolverProxyForSet(object):
     """
     A proxy for recursively evolving a ``PSet``.
     """
+    __slots__ = ('_original', '_evolver', '_children')
+
     def __init__(self, original):
         """
         :param _ISetType original: See ``_IRecursiveEvolverProxy._original``.
         """
         self._original = original
-        self._evolver = original.evolver()
-        self._children = {}
+        self._evolver = None
+        self._children = None
+
+    def _get_evolver(self):
+        """
+        :returns: The evolver of ``original``, creating it if no operations
+            have been performed yet.
+        """
+        if self._evolver is None:
+            self._evolver = self._original.evolver()
+        return self._evolver
+
+    def _get_children(self):
+        """
+        :returns: The ``dict`` of child proxies, creating it if there are no
+            children yet.
+        """
+        if self._children is None:
+            self._children = {}
+        return self._children
 
     def add(self, item):
         """
@@ -217,10 +322,10 @@ class _EvolverProxyForSet(object):
             proxy.
         :returns: ``self``
         """
-        if _IEvolvable.providedBy(item):
-            self._children[item] = _proxy_for_evolvable_object(item)
+        if _proxy_type_for(type(item)) is not None:
+            self._get_children()[item] = _proxy_for_evolvable_object(item)
         else:
-            self._evolver.add(item)
+            self._get_evolver().add(item)
         return self
 
     def remove(self, item):
@@ -233,19 +338,42 @@ class _EvolverProxyForSet(object):
         :param item: The object to be removed from the wrapped ``PSet``
         :returns: ``self``
         """
-        self._children.pop(item, None)
+        if self._children is not None:
+            self._children.pop(item, None)
         # Attempt to remove the item from the evolver too.  It may be something
         # that was replaced rather than added by a previous ``set`` operation.
-        try:
-            self._evolver.remove(item)
-        except KeyError:
-            pass
+        # Until the set has been changed, membership can be checked on the
+        # original rather than by handling the error from the evolver.
+        if self._evolver is None:
+            if item in self._original:
+                self._get_evolver().remove(item)
+        else:
+            try:
+                self._evolver.remove(item)
+            except KeyError:
+                pass
         return self
 
     def commit(self):
-        for segment, child_evolver_proxy in self._children.items():
-            child = child_evolver_proxy.commit()
-            self._evolver.add(child)
+        if self._children is None:
+            children = []
+        else:
+            children = [
+                child_evolver_proxy.commit()
+                for child_evolver_proxy in self._children.itervalues()
+            ]
+        if self._evolver is None:
+            # Unchanged children that are still in the set don't need to be
+            # added again.
+            original = self._original
+            children = [child for child in children if child not in original]
+            # Nothing was changed, so the original can be shared rather than
+            # being rebuilt.
+            if not children:
+                return original
+        add = self._get_evolver().add
+        for child in children:
+            add(child)
         return self._evolver.persistent()
 
 
@@ -255,14 +383,34 @@ class _EvolverProxyForRecord(object):
     """
     A proxy for recursively evolving a ``PMap`` or ``PClass``.
     """
+    __slots__ = ('_original', '_evolver', '_children')
+
     def __init__(self, original):
         """
         :param _IRecordType original: See
             ``_IRecursiveEvolverProxy._original``.
         """
         self._original = original
-        self._evolver = original.evolver()
-        self._children = {}
+        self._evolver = None
+        self._children = None
+
+    def _get_evolver(self):
+        """
+        :returns: The evolver of ``original``, creating it if no operations
+            have been performed yet.
+        """
+        if self._evolver is None:
+            self._evolver = self._original.evolver()
+        return self._evolver
+
+    def _get_children(self):
+        """
+        :returns: The ``dict`` of child proxies, creating it if there are no
+            children yet.
+        """
+        if self._children is None:
+            self._children = {}
+        return self._children
 
     def set(self, key, item):
         """
@@ -276,11 +424,11 @@ class _EvolverProxyForRecord(object):
             this proxy.
         :returns: ``self``
         """
-        if _IEvolvable.providedBy(item):
+        if _proxy_type_for(type(item)) is not None:
             # This will replace any existing proxy.
-            self._children[key] = _proxy_for_evolvable_object(item)
+            self._get_children()[key] = _proxy_for_evolvable_object(item)
         else:
-            self._evolver.set(key, item)
+            self._get_evolver().set(key, item)
         return self
 
     def remove(self, key):
@@ -293,26 +441,93 @@ class _EvolverProxyForRecord(object):
         :param key: The key to be removed from the wrapped ``PMap``
         :returns: ``self``
         """
-        self._children.pop(key, None)
+        if self._children is not None:
+            self._children.pop(key, None)
         # Attempt to remove the item from the evolver too.  It may be something
         # that was replaced rather than added by a previous ``set`` operation.
-        try:
-            self._evolver.remove(key)
-        except KeyError:
-            pass
+        # Until the record has been changed, membership can be checked on the
+        # original rather than by handling the error from the evolver.
+        if self._evolver is None:
+            if isinstance(self._original, PClass):
+                present = hasattr(self._original, key)
+            else:
+                present = key in self._original
+            if present:
+                self._get_evolver().remove(key)
+        else:
+            try:
+                self._evolver.remove(key)
+            except KeyError:
+                pass
         return self
 
     def commit(self):
-        for segment, child_evolver_proxy in self._children.items():
-            child = child_evolver_proxy.commit()
-            self._evolver.set(segment, child)
+        if self._children is None:
+            children = []
+        else:
+            children = [
+                (segment, child_evolver_proxy.commit())
+                for segment, child_evolver_proxy in self._children.iteritems()
+            ]
+        if self._evolver is None:
+            # Unchanged children that are still in place don't need to be set
+            # again.
+            original = self._original
+            children = [
+                (segment, child) for segment, child in children
+                if _get(original, segment, _sentinel) is not child
+            ]
+            # Nothing was changed, so the original can be shared rather than
+            # being rebuilt.
+            if not children:
+                return original
+        set_ = self._get_evolver().set
+        for segment, child in children:
+            set_(segment, child)
         return self._evolver.persistent()
 
 
+# Maps types to the ``_IRecursiveEvolverProxy`` implementation used for their
+# instances, or ``None`` if there is none.  Filled in lazily by
+# ``_proxy_type_for``.
+_PROXY_TYPES = {}
+
+
+def _proxy_type_for(object_type):
+    """
+    Find the proxy implementation for instances of a type.
+
+    The result is cached, so the interfaces of a type are only inspected the
+    first time a proxy is needed for one of its instances.
+
+    :param type object_type: The type of the object to be proxied.
+
+    :returns: The ``_IRecursiveEvolverProxy`` implementation suitable for
+        ``object_type``, or ``None`` if its instances can't be proxied.
+    """
+    try:
+        return _PROXY_TYPES[object_type]
+    except KeyError:
+        pass
+    if not _IEvolvable.implementedBy(object_type):
+        proxy_type = None
+    elif _ISetType.implementedBy(object_type):
+        proxy_type = _EvolverProxyForSet
+    elif _IRecordType.implementedBy(object_type):
+        proxy_type = _EvolverProxyForRecord
+    else:
+        proxy_type = None
+    _PROXY_TYPES[object_type] = proxy_type
+    return proxy_type
+
+
 def _proxy_for_evolvable_object(obj):
     """
     :returns: an ``_IRecursiveEvolverProxy`` suitable for the type of ``obj``.
     """
+    proxy_type = _proxy_type_for(type(obj))
+    if proxy_type is not None:
+        return proxy_type(obj)
     if not _IEvolvable.providedBy(obj):
         raise TypeError(
             "{!r} does not provide {}".format(
@@ -320,12 +535,9 @@ def _proxy_for_evolvable_object(obj):
                 _IEvolvable.__name__
             )
         )
-    if _ISetType.providedBy(obj):
-        return _EvolverProxyForSet(obj)
-    elif _IRecordType.providedBy(obj):
-        return _EvolverProxyForRecord(obj)
-    else:
-        raise TypeError("Object '{}' does not provide a supported interface")
+    raise TypeError(
+        "Object '{!r}' does not provide a supported interface".format(obj)
+    )
 
 
 def _get_or_add_proxy_child(parent_proxy, segment):
@@ -338,7 +550,8 @@ def _get_or_add_proxy_child(parent_proxy, segment):
     :param unicode segment: The label in a ``path`` supplied to ``transform``.
     :returns:
     """
-    child = parent_proxy._children.get(segment)
+    children = parent_proxy._get_children()
+    child = children.get(segment)
     if child is not None:
         return child
     child = _get(parent_proxy._original, segment, _sentinel)
@@ -349,7 +562,7 @@ def _get_or_add_proxy_child(parent_proxy, segment):
             )
         )
     proxy_for_child = _proxy_for_evolvable_object(child)
-    parent_proxy._children[segment] = proxy_for_child
+    children[segment] = proxy_for_child
     return proxy_for_child
 
 
@@ -362,33 +575,64 @@ class _TransformProxy(object):
     Leaf nodes are persisted first and in isolation, so as not to trigger
     invariant errors in ancestor nodes.
     """
+    __slots__ = ('_root', '_last_path', '_last_targets')
+
     def __init__(self, original):
         """
         :param _IEvolvable original: The root object to which transformations
             will be applied.
         """
         self._root = _proxy_for_evolvable_object(original)
+        self._last_path = ()
+        self._last_targets = [self._root]
 
-    def transform(self, path, operation):
+    def target(self, path):
         """
         Traverse each segment of ``path`` to create a hierarchy of
-        ``_EvolverProxy`` objects and perform the ``operation`` on the
-        resulting leaf proxy object. This will infact perform the operation on
-        an evolver of the original Pyrsistent object.
+        ``_EvolverProxy`` objects and return the resulting leaf proxy object.
+        Operations on the leaf proxy are infact performed on an evolver of the
+        original Pyrsistent object.
 
         The object corresponding to the last segment of ``path`` must provide
         the ``_IEvolvable`` interface.
 
+        :param PVector path: The path relative to ``original`` of the object
+            to be operated on.
+        :returns: The ``_IRecursiveEvolverProxy`` for the object at ``path``.
+        """
+        # Consecutive changes usually share a path, or at least a prefix of
+        # one, for example when setting several fields of one object.
+        # Operations on the leaf proxy can only replace its children, so the
+        # proxies along the previous path are still valid and only the part
+        # of the path that differs needs to be walked.
+        last_path = self._last_path
+        if path is last_path:
+            return self._last_targets[-1]
+        common = 0
+        limit = min(len(path), len(last_path))
+        while common < limit and path[common] == last_path[common]:
+            common += 1
+        targets = self._last_targets[:common + 1]
+        target = targets[-1]
+        for segment in path[common:]:
+            target = _get_or_add_proxy_child(target, segment)
+            targets.append(target)
+        self._last_path = path
+        self._last_targets = targets
+        return target
+
+    def transform(self, path, operation):
+        """
+        Perform the ``operation`` on the leaf proxy object for ``path``.  See
+        ``target``.
+
         :param PVector path: The path relative to ``original`` which will be
             operated on.
         :param callable operation: A function to be applied to an evolver of
              the object at ``path``
         :returns: ``self``
         """
-        target = self._root
-        for segment in path:
-            target = _get_or_add_proxy_child(target, segment)
-        operation(target)
+        operation(self.target(path))
         return self
 
     def commit(self):
@@ -442,111 +686,244 @@ class Diff(PClass):
             raise
 
 
-def _create_diffs_for_sets(current_path, set_a, set_b):
+class _DiffMemo(object):
+    """
+    Results that are reused while computing a single diff.
+
+    Objects shared within a structure can be reached through more than one
+    path, and the same pair of objects is compared both before and while
+    recursing into them.  The objects the results are keyed on are kept
+    alive by the memo so that their ids can't be reused by other objects
+    while the diff is being computed.
+
+    :ivar dict comparisons: Maps the ids of pairs of objects that have been
+        compared to the objects and whether they were equal.
+    :ivar dict dicts: Maps the ids of ``PClass`` instances to the instance
+        and its fields as a ``dict``.
+    """
+    def __init__(self):
+        self.comparisons = {}
+        self.dicts = {}
+
+    def to_dict(self, pclass):
+        """
+        :param PClass pclass: The object to convert.
+
+        :returns: The fields of ``pclass`` as a ``dict``.
+        """
+        try:
+            return self.dicts[id(pclass)][1]
+        except KeyError:
+            pass
+        fields = pclass._to_dict()
+        self.dicts[id(pclass)] = (pclass, fields)
+        return fields
+
+
+def _create_diffs_for_sets(current_path, set_a, set_b, memo):
     """
     Computes a series of ``_IDiffChange`` s to turn ``set_a`` into ``set_b``
     assuming that these sets are at ``current_path`` inside a nested pyrsistent
     object.
 
-    :param current_path: An iterable of pyrsistent object describing the path
-        inside the root pyrsistent object where the other arguments are
-        located.  See ``PMap.transform`` for the format of this sort of path.
+    :param tuple current_path: The path inside the root pyrsistent object
+        where the other arguments are located.  See ``PMap.transform`` for the
+        format of this sort of path.
 
     :param set_a: The desired input set.
 
     :param set_b: The desired output set.
 
+    :param _DiffMemo memo: See ``_create_diffs_for``.
+
     :returns: An iterable of ``_IDiffChange`` s that will turn ``set_a`` into
         ``set_b``.
     """
-    resulting_diffs = pvector([]).evolver()
-    for item in set_a.difference(set_b):
-        resulting_diffs.append(
-            _Remove(path=current_path, item=item)
-        )
-    for item in set_b.difference(set_a):
-        resulting_diffs.append(
-            _Add(path=current_path, item=item)
-        )
-    return resulting_diffs.persistent()
+    # Differences between frozensets are computed entirely in C, unlike
+    # differences between PSets, so only the changes themselves are built by
+    # Python code.
+    items_a = frozenset(set_a)
+    items_b = frozenset(set_b)
+    resulting_diffs = [
+        _interned(_Remove, current_path, item=item)
+        for item in items_a - items_b
+    ]
+    resulting_diffs.extend(
+        _interned(_Add, current_path, item=item)
+        for item in items_b - items_a
+    )
+    return pvector(resulting_diffs)
 
 
-def _create_diffs_for_mappings(current_path, mapping_a, mapping_b):
+def _create_diffs_for_mappings(current_path, mapping_a, mapping_b, memo):
     """
     Computes a series of ``_IDiffChange`` s to turn ``mapping_a`` into
     ``mapping_b`` assuming that these mappings are at ``current_path`` inside a
     nested pyrsistent object.
 
-    :param current_path: An iterable of pyrsistent object describing the path
-        inside the root pyrsistent object where the other arguments are
-        located.  See ``PMap.transform`` for the format of this sort of path.
+    :param tuple current_path: The path inside the root pyrsistent object
+        where the other arguments are located.  See ``PMap.transform`` for the
+        format of this sort of path.
 
     :param mapping_a: The desired input mapping.
 
     :param mapping_b: The desired output mapping.
 
+    :param _DiffMemo memo: See ``_create_diffs_for``.
+
     :returns: An iterable of ``_IDiffChange`` s that will turn ``mapping_a``
         into ``mapping_b``.
     """
-    resulting_diffs = pvector([]).evolver()
-    a_keys = frozenset(mapping_a.keys())
-    b_keys = frozenset(mapping_b.keys())
-    for key in a_keys.intersection(b_keys):
-        if mapping_a[key] != mapping_b[key]:
+    resulting_diffs = []
+    removals = []
+    # Copying the mappings into dicts is done in C, after which the lookups
+    # are much cheaper than on a ``PMap``.  Both mappings are then walked
+    # once, rather than building sets of their keys to intersect and
+    # subtract.
+    items_a = dict(mapping_a.items())
+    items_b = dict(mapping_b.items())
+    for key, value_a in items_a.iteritems():
+        value_b = items_b.get(key, _sentinel)
+        if value_b is _sentinel:
+            removals.append(
+                _interned(_Remove, current_path, item=key)
+            )
+        elif not _equal(value_a, value_b, memo):
             resulting_diffs.extend(
                 _create_diffs_for(
-                    current_path.append(key),
-                    mapping_a[key],
-                    mapping_b[key]
+                    current_path + (key,),
+                    value_a,
+                    value_b,
+                    memo,
                 )
             )
-    for key in b_keys.difference(a_keys):
-        resulting_diffs.append(
-            _Set(path=current_path, key=key, value=mapping_b[key])
-        )
-    for key in a_keys.difference(b_keys):
-        resulting_diffs.append(
-            _Remove(path=current_path, item=key)
-        )
-    return resulting_diffs.persistent()
+    # Every key of ``mapping_a`` that wasn't removed is in ``mapping_b``, so
+    # unless ``mapping_b`` is larger than that there are no keys to add.
+    if len(items_b) > len(items_a) - len(removals):
+        for key, value_b in items_b.iteritems():
+            if key not in items_a:
+                resulting_diffs.append(
+                    _interned(_Set, current_path, key=key, value=value_b)
+                )
+    resulting_diffs.extend(removals)
+    return pvector(resulting_diffs)
 
 
-def _create_diffs_for(current_path, subobj_a, subobj_b):
+def _create_diffs_for_pclasses(current_path, pclass_a, pclass_b, memo):
+    """
+    Computes a series of ``_IDiffChange`` s to turn ``pclass_a`` into
+    ``pclass_b`` assuming that these objects are at ``current_path`` inside a
+    nested pyrsistent object.
+
+    :param current_path: See ``_create_diffs_for_mappings``.
+
+    :param PClass pclass_a: The desired input object.
+
+    :param PClass pclass_b: The desired output object.
+
+    :param _DiffMemo memo: See ``_create_diffs_for``.
+
+    :returns: An iterable of ``_IDiffChange`` s that will turn ``pclass_a``
+        into ``pclass_b``.
+    """
+    return _create_diffs_for_mappings(
+        current_path, memo.to_dict(pclass_a), memo.to_dict(pclass_b), memo)
+
+
+# Maps the types of objects that are diffed to the function that knows how to
+# diff two objects of that type, or ``None`` if they can only be replaced.
+# Filled in lazily by ``_diff_handler_for_type``.
+_DIFF_HANDLERS = {}
+
+
+def _diff_handler_for_type(object_type):
+    """
+    Find the function that can diff two objects of the given type.
+
+    The result is cached, so the type hierarchy is only inspected the first
+    time a type is diffed.
+
+    :param type object_type: The type of the objects being diffed.
+
+    :returns: A function taking the current path, two objects of
+        ``object_type`` and a ``_DiffMemo``, or ``None`` if there is no
+        better diff than replacing one object with the other.
+    """
+    try:
+        return _DIFF_HANDLERS[object_type]
+    except KeyError:
+        pass
+    if issubclass(object_type, PClass):
+        handler = _create_diffs_for_pclasses
+    elif issubclass(object_type, PMap):
+        handler = _create_diffs_for_mappings
+    elif issubclass(object_type, PSet):
+        handler = _create_diffs_for_sets
+    else:
+        handler = None
+    _DIFF_HANDLERS[object_type] = handler
+    return handler
+
+
+def _equal(object_a, object_b, memo):
+    """
+    Compare two objects, remembering the result in ``memo``.
+
+    :param object_a: An object to compare.
+    :param object_b: An object to compare.
+    :param _DiffMemo memo: See ``_create_diffs_for``.
+
+    :returns: ``True`` if the objects are equal, ``False`` otherwise.
+    """
+    # Unchanged parts of an evolved structure are usually shared with the
+    # original, and comparing them by identity avoids walking the whole
+    # subtree to check they are equal.
+    if object_a is object_b:
+        return True
+    key = (id(object_a), id(object_b))
+    try:
+        return memo.comparisons[key][2]
+    except KeyError:
+        pass
+    equal = object_a == object_b
+    memo.comparisons[key] = (object_a, object_b, equal)
+    return equal
+
+
+def _create_diffs_for(current_path, subobj_a, subobj_b, memo):
     """
     Computes a series of ``_IDiffChange`` s to turn ``subobj_a`` into
     ``subobj_b`` assuming that these subobjs are at ``current_path`` inside a
     nested pyrsistent object.
 
-    :param current_path: An iterable of pyrsistent object describing the path
-        inside the root pyrsistent object where the other arguments are
-        located.  See ``PMap.transform`` for the format of this sort of path.
+    :param tuple current_path: The path inside the root pyrsistent object
+        where the other arguments are located.  See ``PMap.transform`` for the
+        format of this sort of path.
 
     :param subobj_a: The desired input sub object.
 
     :param subobj_b: The desired output sub object.
 
+    :param _DiffMemo memo: The results already computed for this diff.
+
     :returns: An iterable of ``_IDiffChange`` s that will turn ``subobj_a``
         into ``subobj_b``.
     """
-    if subobj_a == subobj_b:
+    if _equal(subobj_a, subobj_b, memo):
         return pvector([])
-    elif isinstance(subobj_a, PClass) and isinstance(subobj_b, PClass):
-        a_dict = subobj_a._to_dict()
-        b_dict = subobj_b._to_dict()
-        return _create_diffs_for_mappings(current_path, a_dict, b_dict)
-    elif isinstance(subobj_a, PMap) and isinstance(subobj_b, PMap):
-        return _create_diffs_for_mappings(
-            current_path, subobj_a, subobj_b)
-    elif isinstance(subobj_a, PSet) and isinstance(subobj_b, PSet):
-        return _create_diffs_for_sets(
-            current_path, subobj_a, subobj_b)
+    object_type = type(subobj_a)
+    if type(subobj_b) is object_type:
+        handler = _diff_handler_for_type(object_type)
+        if handler is not None:
+            return handler(current_path, subobj_a, subobj_b, memo)
     # If the objects are not equal, and there is no intelligent way to recurse
     # inside the objects to make a smaller diff, simply set the current path
     # to the object in b.
     if len(current_path) > 0:
         return pvector([
-            _Set(
-                path=current_path[:-1],
+            _interned(
+                _Set,
+                current_path[:-1],
                 key=current_path[-1],
                 value=subobj_b
             )
@@ -570,7 +947,7 @@ def create_diff(object_a, object_b):
     :returns:  A ``Diff`` that will convert ``object_a`` into ``object_b``
         when applied.
     """
-    changes = _create_diffs_for(pvector([]), object_a, object_b)
+    changes = _create_diffs_for((), object_a, object_b, _DiffMemo())
     return Diff(changes=changes)
 
 
@@ -587,12 +964,12 @@ def compose_diffs(iterable_of_diffs):
     :returns: A new diff such that applying this diff is equivalent to applying
         each of the input diffs in serial.
     """
+    diffs = list(iterable_of_diffs)
+    # Diffs are immutable, so a single diff is already its own composition.
+    if len(diffs) == 1:
+        return diffs[0]
     return Diff(
-        changes=reduce(
-            lambda x, y: x.extend(y.changes),
-            iterable_of_diffs,
-            pvector().evolver()
-        ).persistent()
+        changes=pvector([change for diff in diffs for change in diff.changes])
     )
 
 
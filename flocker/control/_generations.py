@@ -44,6 +44,10 @@ class GenerationTracker(object):
         version.
     :ivar _latest_object: The most recent version of the object being tracked.
     :ivar _latest_hash: The most recent hash of the object being tracked.
+    :ivar _diffs_to_latest: A ``dict`` mapping generation hashes to the
+        ``Diff`` already returned by ``get_diff_from_hash_to_latest`` for them.
+        Returning the same ``Diff`` object to every caller lets its encoding
+        be cached.  Emptied whenever the latest hash changes.
     """
 
     def __init__(self, cache_size):
@@ -57,6 +61,7 @@ class GenerationTracker(object):
         self._queue = deque(maxlen=cache_size)
         self._latest_object = None
         self._latest_hash = None
+        self._diffs_to_latest = {}
 
     def get_latest(self):
         """
@@ -97,6 +102,8 @@ class GenerationTracker(object):
                 )
             )
 
+        if latest_hash != self._latest_hash:
+            self._diffs_to_latest = {}
         self._latest_object = latest
         self._latest_hash = latest_hash
 
@@ -115,17 +122,24 @@ class GenerationTracker(object):
         if generation_hash is None:
             return None
 
-        if self._latest_hash == generation_hash:
-            return compose_diffs([])
-
-        results = []
-        for record in self._queue:
-            if record.generation_hash == generation_hash:
-                results = [record.diff_to_next]
-            elif results:
-                results.append(record.diff_to_next)
+        try:
+            return self._diffs_to_latest[generation_hash]
+        except KeyError:
+            pass
 
-        if results:
-            return compose_diffs(results)
+        if self._latest_hash == generation_hash:
+            diff = compose_diffs([])
         else:
-            return None
+            results = []
+            for record in self._queue:
+                if record.generation_hash == generation_hash:
+                    results = [record.diff_to_next]
+                elif results:
+                    results.append(record.diff_to_next)
+
+            if not results:
+                return None
+            diff = compose_diffs(results)
+
+        self._diffs_to_latest[generation_hash] = diff
+        return diff
@@ -11,6 +11,8 @@ from json import dumps, loads
 from mmh3 import hash_bytes as mmh3_hash_bytes
 from uuid import UUID
 from collections import Set, Mapping, Iterable
+from functools import partial
+from itertools import chain
 
 from eliot import Logger, write_traceback, MessageType, Field, ActionType
 
@@ -23,7 +25,7 @@ from twisted.application.service import Service, MultiService
 from twisted.internet.defer import succeed
 from twisted.internet.task import LoopingCall
 
-from weakref import WeakKeyDictionary
+from weakref import WeakKeyDictionary, ref as weakref
 
 from ._model import (
     SERIALIZABLE_CLASSES, Deployment, Configuration, GenerationHash
@@ -283,6 +285,56 @@ _BASIC_JSON_COLLECTIONS = frozenset([dict]).union(_BASIC_JSON_LISTS)
 _UNCACHED_SENTINEL = object()
 
 
+class _IdentityCache(object):
+    """
+    A cache keyed on object identity which does not keep its keys alive.
+
+    Unlike a ``WeakKeyDictionary``, looking up an object does not require
+    computing its hash, which for pyrsistent objects is a deep, uncached
+    computation over the whole object.  Equal but distinct objects get
+    separate entries.
+
+    :ivar dict _entries: Map ``id()`` of cached objects to a weak reference
+        to the object and its cached value.
+    """
+    def __init__(self):
+        self._entries = {}
+
+    def get(self, key, default=None):
+        """
+        :return: The value cached for ``key``, or ``default``.
+        """
+        entry = self._entries.get(id(key))
+        if entry is not None and entry[0]() is key:
+            return entry[1]
+        return default
+
+    def __setitem__(self, key, value):
+        """
+        Cache a value until ``key`` is garbage collected.
+
+        :raise TypeError: If ``key`` cannot be weakly referenced.
+        """
+        object_id = id(key)
+        self._entries[object_id] = (
+            weakref(key, partial(self._forget, object_id)), value
+        )
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _forget(self, object_id, ref):
+        """
+        Remove the entry for a garbage collected object.
+
+        :param int object_id: The ``id()`` of the collected object.
+        :param ref: The weak reference to the collected object.
+        """
+        entry = self._entries.get(object_id)
+        if entry is not None and entry[0] is ref:
+            del self._entries[object_id]
+
+
 _cached_dfs_serialize_cache = WeakKeyDictionary()
 
 
@@ -347,7 +399,13 @@ _NULLSET_TOKEN = mmh3_hash_bytes(b'NULLSET')
 _MAPPING_TOKEN = mmh3_hash_bytes(b'MAPPING')
 _STR_TOKEN = mmh3_hash_bytes(b'STRING')
 
-_generation_hash_cache = WeakKeyDictionary()
+# Generation hashes of pyrsistent objects are cached by identity, which is
+# cheap to look up, and by equality, which lets equal copies (e.g. freshly
+# decoded from the wire) share a hash.  Looking an object up by equality
+# computes its (deep, uncached) Python hash, so only the objects passed to
+# ``generation_hash`` are looked up by equality, not each of their parts:
+_generation_hash_cache = _IdentityCache()
+_generation_hash_equal_cache = WeakKeyDictionary()
 
 
 def _xor_bytes(aggregating_bytearray, updating_bytes):
@@ -377,6 +435,32 @@ def generation_hash(input_object):
     This computes the mmh3 hash for an input object, providing a consistent
     hash of deeply persistent objects across python nodes and implementations.
 
+    :returns: An mmh3 hash of input_object.
+    """
+    if _is_pyrsistent(input_object):
+        cached = _generation_hash_cache.get(input_object, _UNCACHED_SENTINEL)
+        if cached is not _UNCACHED_SENTINEL:
+            return cached
+        cached = _generation_hash_equal_cache.get(
+            input_object, _UNCACHED_SENTINEL
+        )
+        if cached is not _UNCACHED_SENTINEL:
+            _generation_hash_cache[input_object] = cached
+            return cached
+        result = _generation_hash(input_object)
+        _generation_hash_equal_cache[input_object] = result
+        return result
+    return _generation_hash(input_object)
+
+
+def _generation_hash(input_object):
+    """
+    Compute the generation hash of ``input_object``, looking up and caching
+    the generation hashes of pyrsistent objects by identity only.
+
+    Unchanged parts of a new version of some object are usually shared with
+    the old version, so only the parts which changed are hashed again.
+
     :returns: An mmh3 hash of input_object.
     """
     # Ensure this is a quick function for basic types:
@@ -413,20 +497,28 @@ def generation_hash(input_object):
         object_to_process = object_to_process._to_dict()
 
     if isinstance(object_to_process, Mapping):
-        # Union a mapping token so that empty maps and empty sets have
-        # different hashes.
-        object_to_process = frozenset(object_to_process.iteritems()).union(
-            [_MAPPING_TOKEN]
+        # Hash a mapping as the set of its items, plus a mapping token so that
+        # empty maps and empty sets have different hashes.  The items are
+        # hashed directly rather than being collected into a ``frozenset``
+        # first: that would compute the (deep, uncached) Python hash of every
+        # value, which costs as much as hashing the whole mapping again even
+        # when most of the values have their generation hash cached already.
+        sub_hashes = chain(
+            [_generation_hash(_MAPPING_TOKEN)],
+            (_generation_hash(item)
+             for item in object_to_process.iteritems()),
         )
-
-    if isinstance(object_to_process, Set):
-        sub_hashes = (generation_hash(x) for x in object_to_process)
+        result = bytes(
+            reduce(_xor_bytes, sub_hashes, bytearray(_NULLSET_TOKEN))
+        )
+    elif isinstance(object_to_process, Set):
+        sub_hashes = (_generation_hash(x) for x in object_to_process)
         result = bytes(
             reduce(_xor_bytes, sub_hashes, bytearray(_NULLSET_TOKEN))
         )
     elif isinstance(object_to_process, Iterable):
         result = mmh3_hash_bytes(b''.join(
-            generation_hash(x) for x in object_to_process
+            _generation_hash(x) for x in object_to_process
         ))
     else:
         result = mmh3_hash_bytes(wire_encode(object_to_process))
@@ -437,20 +529,36 @@ def generation_hash(input_object):
     return result
 
 
+# Cache of the ``GenerationHash`` of objects passed to
+# ``make_generation_hash``:
+_make_generation_hash_cache = _IdentityCache()
+
+
 def make_generation_hash(x):
     """
     Creates a ``GenerationHash`` for a given argument.
 
     Simple helper to call ``generation_hash`` and wrap it in the
-    ``GenerationHash`` ``PClass``.
+    ``GenerationHash`` ``PClass``.  The result is remembered for as long as
+    ``x`` is alive, so hashing the same object again is cheap.
 
     :param x: The object to hash.
 
     :returns: The ``GenerationHash`` for the object.
     """
-    return GenerationHash(
+    result = _make_generation_hash_cache.get(x)
+    if result is not None:
+        return result
+
+    result = GenerationHash(
         hash_value=generation_hash(x)
     )
+    try:
+        _make_generation_hash_cache[x] = result
+    except TypeError:
+        # Not all objects can be weakly referenced, e.g. ``int``.
+        pass
+    return result
 
 
 def wire_encode(obj):
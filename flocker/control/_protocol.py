@@ -27,17 +27,17 @@ Eliot contexts are transferred along with AMP commands, allowing tracing
 of logged actions across processes (see
 http://eliot.readthedocs.org/en/0.6.0/threads.html).
 
-:var _wire_encode_cache: ``LRUCache`` mapping serializable objects to
-    their ``wire_encode`` output.
+:var _wire_encode_cache: ``_ShardedLRUCache`` mapping serializable objects,
+    by identity, to the ``_WireEncoding`` of their ``wire_encode`` output.
 """
 
-from collections import defaultdict
+from collections import OrderedDict
 from datetime import timedelta
-from io import BytesIO
-from itertools import count
+from itertools import count, imap
 from twisted.internet.defer import maybeDeferred
 from uuid import UUID
 from functools import partial
+from threading import Event, Lock
 
 from eliot import (
     Logger, ActionType, Action, Field, MessageType,
@@ -46,8 +46,6 @@ from eliot.twisted import DeferredContext
 
 from pyrsistent import PClass, field
 
-from repoze.lru import LRUCache
-
 from characteristic import with_cmp
 
 from zope.interface import Interface, Attribute
@@ -58,7 +56,6 @@ from twisted.protocols.amp import (
     MAX_VALUE_LENGTH,
 )
 from twisted.internet.error import AlreadyCalled
-from twisted.internet.task import LoopingCall
 from twisted.internet.protocol import ServerFactory
 from twisted.application.internet import StreamServerEndpointService
 from twisted.protocols.tls import TLSMemoryBIOFactory
@@ -76,6 +73,23 @@ from ._generations import GenerationTracker
 PING_INTERVAL = timedelta(seconds=30)
 
 
+def _split(value):
+    """
+    Split bytes into chunks that each fit into a single AMP value.
+
+    :param bytes value: The bytes to split.
+
+    :return: A ``list`` of the consecutive slices of ``value``, each no longer
+        than ``MAX_VALUE_LENGTH``.
+    """
+    # Slice the value directly rather than copying it into a ``BytesIO``
+    # first; each chunk is then only copied once.
+    return [
+        value[offset:offset + MAX_VALUE_LENGTH]
+        for offset in xrange(0, len(value), MAX_VALUE_LENGTH)
+    ]
+
+
 class Big(Argument):
     """
     An ``Argument`` type which can handle objects which are larger than AMP's
@@ -98,17 +112,23 @@ class Big(Argument):
         dictionary with indexed key names so that the chunks can be put back
         together in the correct order during deserialization.
 
+        If the wrapped ``Argument`` has a ``toChunks`` method, as
+        ``SerializableArgument`` does, the chunks are taken from it instead.
+
         See ``IArgumentType`` for argument and return type documentation.
         """
-        self.another_argument.toBox(name, strings, objects, proto)
-        value = BytesIO(strings.pop(name))
-        counter = 0
-        while True:
-            nextChunk = value.read(MAX_VALUE_LENGTH)
-            if not nextChunk:
-                break
-            strings["%s.%d" % (name, counter)] = nextChunk
-            counter += 1
+        to_chunks = getattr(self.another_argument, "toChunks", None)
+        if to_chunks is None:
+            self.another_argument.toBox(name, strings, objects, proto)
+            chunks = _split(strings.pop(name))
+        else:
+            chunks = to_chunks(
+                self.another_argument.retrieve(objects, name, proto))
+        name_dot = name + "."
+        strings.update(
+            (name_dot + str(counter), chunk)
+            for counter, chunk in enumerate(chunks)
+        )
 
     def fromBox(self, name, strings, objects, proto):
         """
@@ -121,19 +141,190 @@ class Big(Argument):
 
         See ``IArgumentType`` for argument and return type documentation.
         """
-
-        value = BytesIO()
-        for counter in count(0):
-            chunk = strings.get("%s.%d" % (name, counter))
-            if chunk is None:
-                break
-            value.write(chunk)
-            strings[name] = value.getvalue()
+        # Look up "name.0", "name.1", ... until one is missing.  This is all
+        # done by builtins so the per-chunk work happens in C rather than in
+        # the interpreter loop.
+        name_dot = name + "."
+        keys = imap(name_dot.__add__, imap(str, count()))
+        chunks = list(iter(imap(strings.get, keys).next, None))
+        # Join once at the end; the chunks may add up to many megabytes.
+        strings[name] = b"".join(chunks)
         self.another_argument.fromBox(name, strings, objects, proto)
 
 
+class _ShardedLRUCache(object):
+    """
+    A least-recently-used cache which is split into shards, each with its own
+    lock, so that concurrent lookups of different keys rarely contend for the
+    same lock.
+
+    Keys are looked up by identity rather than by equality.  Hashing large
+    pyrsistent objects walks all of their contents, while looking them up by
+    ``id`` costs the same however large they are.  Each entry keeps a
+    reference to its key so that the key's ``id`` cannot be reused by
+    another object while the entry is cached.
+
+    Each shard evicts its own least-recently-used entry when it is full, so
+    the cache as a whole only approximates least-recently-used eviction.
+
+    :ivar list _shards: A list of ``(Lock, OrderedDict, dict)`` tuples.  The
+        ``OrderedDict`` of each shard maps the ``id`` of each key to a
+        ``(key, value)`` tuple, ordered from least to most recently used.  The
+        ``dict`` maps the ``id`` of keys whose values are currently being
+        computed by ``get_or_put`` to an ``Event`` which is set once the
+        computation is finished.
+    """
+    def __init__(self, shards, size_per_shard):
+        """
+        :param int shards: The number of shards.  Must be a power of two.
+        :param int size_per_shard: The maximum number of entries in each
+            shard.
+        """
+        self._shard_mask = shards - 1
+        self._size_per_shard = size_per_shard
+        self._shards = [
+            (Lock(), OrderedDict(), {}) for _ in range(shards)
+        ]
+
+    def _shard_for(self, key_id):
+        """
+        :param int key_id: The ``id`` of a key.
+
+        :return: The ``(Lock, OrderedDict, dict)`` of the shard for the key.
+        """
+        # Objects are aligned in memory, so the lowest bits of their ``id``
+        # are always the same:
+        return self._shards[(key_id >> 4) & self._shard_mask]
+
+    def _store(self, entries, key_id, key, value):
+        """
+        Add a value to a shard, evicting its least recently used value if it
+        is full.  The shard's lock must be held.
+        """
+        entries.pop(key_id, None)
+        entries[key_id] = (key, value)
+        if len(entries) > self._size_per_shard:
+            entries.popitem(last=False)
+
+    def get(self, key, default=None):
+        """
+        Look up a cached value, marking it as the most recently used.
+
+        :param key: The key to look up.
+        :param default: The value to return if ``key`` is not cached.
+
+        :return: The cached value, or ``default``.
+        """
+        key_id = id(key)
+        lock, entries, _ = self._shard_for(key_id)
+        with lock:
+            try:
+                entry = entries.pop(key_id)
+            except KeyError:
+                return default
+            entries[key_id] = entry
+            return entry[1]
+
+    def put(self, key, value):
+        """
+        Cache a value, evicting the least recently used value in its shard if
+        the shard is full.
+
+        :param key: The key to cache the value under.
+        :param value: The value to cache.
+        """
+        key_id = id(key)
+        lock, entries, _ = self._shard_for(key_id)
+        with lock:
+            self._store(entries, key_id, key, value)
+
+    def get_or_put(self, key, compute):
+        """
+        Look up a cached value, computing and caching it if it is missing.
+
+        Concurrent calls for the same missing key only compute it once; the
+        other callers wait for that computation to finish and share its
+        result.  The computation happens outside of the shard's lock so that
+        other keys can be looked up meanwhile.
+
+        :param key: The key to look up.
+        :param compute: A one-argument callable which is called with ``key``
+            to compute a missing value.
+
+        :return: The cached or computed value.
+        """
+        key_id = id(key)
+        lock, entries, pending = self._shard_for(key_id)
+        with lock:
+            try:
+                entry = entries.pop(key_id)
+            except KeyError:
+                done = pending.get(key_id)
+                computing = done is None
+                if computing:
+                    done = pending[key_id] = Event()
+            else:
+                entries[key_id] = entry
+                return entry[1]
+
+        if not computing:
+            # If the other computation failed, or its result was evicted
+            # already, compute it ourselves.
+            done.wait()
+            value = self.get(key, _MISSING)
+            if value is _MISSING:
+                value = compute(key)
+            return value
+
+        value = _MISSING
+        try:
+            value = compute(key)
+        finally:
+            with lock:
+                del pending[key_id]
+                if value is not _MISSING:
+                    self._store(entries, key_id, key, value)
+            done.set()
+        return value
+
+
+# Marker for values missing from a _ShardedLRUCache:
+_MISSING = object()
+
+
+class _WireEncoding(object):
+    """
+    The ``wire_encode`` output for an object, as cached by
+    ``_wire_encode_cache``.
+
+    :ivar bytes encoded: The ``wire_encode`` output.
+    :ivar _chunks: ``None``, or the ``list`` returned by ``chunks`` once it
+        has been called.
+    """
+    def __init__(self, obj):
+        """
+        :param obj: The object to encode.
+        """
+        self.encoded = wire_encode(obj)
+        self._chunks = None
+
+    def chunks(self):
+        """
+        Split the encoded bytes for ``Big``.
+
+        The same command is often sent to many agents, so the chunks are
+        only split once and then kept for as long as the encoding is cached.
+
+        :return: A ``list`` of ``bytes`` as returned by ``_split``.
+        """
+        chunks = self._chunks
+        if chunks is None:
+            chunks = self._chunks = _split(self.encoded)
+        return chunks
+
+
 # The configuration and state can get pretty big, so don't want too many:
-_wire_encode_cache = LRUCache(50)
+_wire_encode_cache = _ShardedLRUCache(shards=8, size_per_shard=6)
 
 
 def caching_wire_encode(obj):
@@ -141,6 +332,9 @@ def caching_wire_encode(obj):
     Encode an object to bytes using ``wire_encode`` and cache the result,
     or return cached result if available.
 
+    Concurrent calls for the same object only encode it once; the other
+    callers wait for that encoding to finish and share its result.
+
     This relies on cached objects being immutable, or at least not being
     modified. Given our usage patterns that is currently the case and
     should continue to be, but worth keeping in mind.
@@ -148,11 +342,18 @@ def caching_wire_encode(obj):
     :param obj: Object to encode.
     :return: Resulting ``bytes``.
     """
-    result = _wire_encode_cache.get(obj)
-    if result is None:
-        result = wire_encode(obj)
-        _wire_encode_cache.put(obj, result)
-    return result
+    return _wire_encode_cache.get_or_put(obj, _WireEncoding).encoded
+
+
+def caching_wire_encode_chunks(obj):
+    """
+    Like ``caching_wire_encode``, but return the encoded bytes split into
+    chunks for ``Big``.  The chunks are cached along with the encoding.
+
+    :param obj: Object to encode.
+    :return: A ``list`` of ``bytes`` as returned by ``_split``.
+    """
+    return _wire_encode_cache.get_or_put(obj, _WireEncoding).chunks()
 
 
 class SerializableArgument(Argument):
@@ -171,18 +372,114 @@ class SerializableArgument(Argument):
 
     def fromString(self, in_bytes):
         obj = wire_decode(in_bytes)
-        if not isinstance(obj, self._expected_classes):
+        expected_classes = self._expected_classes
+        if not isinstance(obj, expected_classes):
             raise TypeError(
-                "{} is none of {}".format(obj, self._expected_classes)
+                "{} is none of {}".format(obj, expected_classes)
             )
         return obj
 
+    def _check_sent(self, obj):
+        """
+        Check the type of an object being sent.
+
+        Objects being sent come from our own code, so like an assertion
+        this check is skipped when running optimized (``python -O``).
+        Received objects are always checked by ``fromString``.
+        """
+        if __debug__:
+            if not isinstance(obj, self._expected_classes):
+                raise TypeError(
+                    "{} is none of {}".format(obj, self._expected_classes)
+                )
+
+    def toString(self, obj):
+        self._check_sent(obj)
+        return caching_wire_encode(obj)
+
+    def toChunks(self, obj):
+        """
+        Serialize an object for ``Big``.
+
+        :param obj: The object to serialize.
+
+        :return: A ``list`` of ``bytes`` which joined together are the
+            result of ``toString``.
+        """
+        self._check_sent(obj)
+        return caching_wire_encode_chunks(obj)
+
+
+class _GenerationHashArgument(Argument):
+    """
+    AMP argument for a ``GenerationHash``, sent as the raw hash bytes.
+
+    Generation hashes are small, so unlike most model objects they need
+    neither ``wire_encode`` nor ``Big``.  A ``GenerationHash`` with a
+    ``hash_value`` of ``None`` is sent as empty bytes; no real hash is empty.
+    """
+    def fromString(self, in_bytes):
+        if not in_bytes:
+            return GenerationHash(hash_value=None)
+        return GenerationHash(hash_value=in_bytes)
+
     def toString(self, obj):
-        if not isinstance(obj, self._expected_classes):
+        if not isinstance(obj, GenerationHash):
             raise TypeError(
-                "{} is none of {}".format(obj, self._expected_classes)
+                "{} is not a {}".format(obj, GenerationHash)
             )
-        return caching_wire_encode(obj)
+        if obj.hash_value is None:
+            return b""
+        return b"".join(map(chr, obj.hash_value))
+
+
+class _ConfigAndStateGeneration(PClass):
+    """
+    Helper object to store a pair of hashes representing a generation of the
+    configuration and a generation of the state.
+
+    :ivar config_hash: The configuration generation hash.
+
+    :ivar state_hash: The state generation hash.
+    """
+    config_hash = field(type=(GenerationHash, type(None)), initial=None)
+    state_hash = field(type=(GenerationHash, type(None)), initial=None)
+
+
+# The generations of a connection which has not yet acknowledged any update:
+_NO_GENERATIONS = _ConfigAndStateGeneration()
+
+
+class _GenerationHashPairArgument(Argument):
+    """
+    AMP argument for a ``_ConfigAndStateGeneration``, sent as one value
+    holding both raw hashes.
+
+    The value is the length of the configuration hash as a single byte,
+    followed by the configuration hash and then the state hash, each encoded
+    as by ``_GenerationHashArgument``.
+    """
+    _hash_argument = _GenerationHashArgument()
+
+    def fromString(self, in_bytes):
+        config_length = ord(in_bytes[0])
+        return _ConfigAndStateGeneration(
+            config_hash=self._hash_argument.fromString(
+                in_bytes[1:1 + config_length]
+            ),
+            state_hash=self._hash_argument.fromString(
+                in_bytes[1 + config_length:]
+            ),
+        )
+
+    def toString(self, obj):
+        if not isinstance(obj, _ConfigAndStateGeneration):
+            raise TypeError(
+                "{} is not a {}".format(obj, _ConfigAndStateGeneration)
+            )
+        config_bytes = self._hash_argument.toString(obj.config_hash)
+        state_bytes = self._hash_argument.toString(obj.state_hash)
+        return b"".join([chr(len(config_bytes)), config_bytes, state_bytes])
 
 
 class _EliotActionArgument(Unicode):
@@ -222,10 +519,7 @@ class NoOp(Command):
 # Both cluster update commands are expected to have responses with a similar
 # signature:
 CLUSTER_UPDATE_RESPONSE = [
-    ('current_configuration_generation',
-     Big(SerializableArgument(GenerationHash))),
-    ('current_state_generation',
-     Big(SerializableArgument(GenerationHash))),
+    ('current_generations', _GenerationHashPairArgument()),
 ]
 
 
@@ -239,10 +533,10 @@ class ClusterStatusCommand(Command):
     """
     arguments = [('configuration', Big(SerializableArgument(Deployment))),
                  ('configuration_generation',
-                  Big(SerializableArgument(GenerationHash))),
+                  _GenerationHashArgument()),
                  ('state', Big(SerializableArgument(DeploymentState))),
                  ('state_generation',
-                  Big(SerializableArgument(GenerationHash))),
+                  _GenerationHashArgument()),
                  ('eliot_context', _EliotActionArgument())]
     response = CLUSTER_UPDATE_RESPONSE
 
@@ -259,14 +553,14 @@ class ClusterStatusDiffCommand(Command):
     """
     arguments = [('configuration_diff', Big(SerializableArgument(Diff))),
                  ('start_configuration_generation',
-                  Big(SerializableArgument(GenerationHash))),
+                  _GenerationHashArgument()),
                  ('end_configuration_generation',
-                  Big(SerializableArgument(GenerationHash))),
+                  _GenerationHashArgument()),
                  ('state_diff', Big(SerializableArgument(Diff))),
                  ('start_state_generation',
-                  Big(SerializableArgument(GenerationHash))),
+                  _GenerationHashArgument()),
                  ('end_state_generation',
-                  Big(SerializableArgument(GenerationHash))),
+                  _GenerationHashArgument()),
                  ('eliot_context', _EliotActionArgument())]
     response = CLUSTER_UPDATE_RESPONSE
 
@@ -473,6 +767,12 @@ class ControlAMP(AMP):
 
     :ivar Pinger _pinger: Helper which periodically pings this protocol's peer
         to verify it's still alive.
+    :ivar _update_state: The ``_UpdateState`` of the state update currently
+        in progress to this connection, or ``None`` if there is none.  This
+        is managed by ``ControlAMPService``.
+    :ivar _ConfigAndStateGeneration _last_received_generation: The
+        generations of configuration and state the peer last acknowledged.
+        This is managed by ``ControlAMPService``.
     """
     def __init__(self, reactor, control_amp_service):
         """
@@ -487,6 +787,17 @@ class ControlAMP(AMP):
 
         self.control_amp_service = control_amp_service
         self._pinger = Pinger(reactor)
+        self._update_state = None
+        self._last_received_generation = _NO_GENERATIONS
+
+    def callRemote(self, command, **kwargs):
+        """
+        Send a command to the peer, postponing the next ping.
+
+        See ``AMP.callRemote`` for argument and return value documentation.
+        """
+        self._pinger.sent()
+        return AMP.callRemote(self, command, **kwargs)
 
     def connectionMade(self):
         AMP.connectionMade(self)
@@ -500,13 +811,14 @@ class ControlAMP(AMP):
         self._ping_timeout.cancel()
 
 
-# These two logging fields use caching_wire_encode as the serializer so
-# that they can share the encoding cache with the network code related to
-# this logging.  This reduces the overhead of logging these (potentially
-# quite large) data structures.
-DEPLOYMENT_CONFIG = Field(u"configuration", caching_wire_encode,
-                          u"The cluster configuration")
-CLUSTER_STATE = Field(u"state", caching_wire_encode, u"The cluster state")
+# These two logging fields are given the configuration and state already
+# encoded by caching_wire_encode, the same encoding which is sent over the
+# network.  This avoids encoding (or even looking up the encodings of) these
+# potentially quite large data structures again just for logging.
+DEPLOYMENT_CONFIG = Field(u"configuration", lambda encoded: encoded,
+                          u"The encoded cluster configuration")
+CLUSTER_STATE = Field(u"state", lambda encoded: encoded,
+                      u"The encoded cluster state")
 
 LOG_SEND_CLUSTER_STATE = ActionType(
     "flocker:controlservice:send_cluster_state",
@@ -558,18 +870,37 @@ AGENT_UPDATE_DELAYED = MessageType(
     u"progress.",
 )
 
+AGENT_UPDATE_UNNECESSARY = MessageType(
+    "flocker:controlservice:agent_update_unnecessary",
+    [AGENT],
+    u"An update to an agent was not sent because the agent already has (or "
+    u"has already been sent) the latest configuration and state.",
+)
+
 
-class _UpdateState(PClass):
+class _UpdateState(object):
     """
-    Represent the state related to sending a ``ClusterStatusCommand`` to an
-    agent.
-
-    :ivar response: The pending result of an update that is in progress.
-    :ivar scheduled: ``True`` if another update should be performed as soon as
-        the current one is done, ``False`` otherwise.
+    Represent the state related to sending ``ClusterStatusCommand`` and
+    ``ClusterStatusDiffCommand`` to an agent.
+
+    This is only ever used by ``ControlAMPService``, which updates it in place
+    as updates are sent and acknowledged.
+
+    :ivar list responses: The pending results of the updates that are in
+        progress, oldest first.
+    :ivar next_scheduled: ``True`` if another update should be performed as
+        soon as the oldest one in progress is done, ``False`` otherwise.
+    :ivar _ConfigAndStateGeneration sent_generations: The generations of
+        configuration and state the agent will have once it has processed the
+        newest update in progress, or ``_NO_GENERATIONS`` if that is unknown
+        because an update failed.
     """
-    response = field()
-    next_scheduled = field()
+    __slots__ = ('responses', 'next_scheduled', 'sent_generations')
+
+    def __init__(self):
+        self.responses = []
+        self.next_scheduled = False
+        self.sent_generations = _NO_GENERATIONS
 
 
 # The control service waits this long before sending any update to an agent.
@@ -578,18 +909,11 @@ class _UpdateState(PClass):
 # fixed period of time.
 CONTROL_SERVICE_BATCHING_DELAY = 1.0
 
-
-class _ConfigAndStateGeneration(PClass):
-    """
-    Helper object to store a pair of hashes representing a generation of the
-    configuration and a generation of the state.
-
-    :ivar config_hash: The configuration generation hash.
-
-    :ivar state_hash: The state generation hash.
-    """
-    config_hash = field(type=(GenerationHash, type(None)), initial=None)
-    state_hash = field(type=(GenerationHash, type(None)), initial=None)
+# The control service sends at most this many updates to an agent before
+# waiting for the oldest of them to be acknowledged.  Allowing more than one
+# lets the next update be sent while the agent is still processing the
+# previous one, rather than costing a round trip per update.
+CONTROL_SERVICE_MAX_UPDATES_IN_FLIGHT = 2
 
 
 class ControlAMPService(Service):
@@ -598,14 +922,20 @@ class ControlAMPService(Service):
 
     Convergence agents connect to this server.
 
-    :ivar dict _current_command: A dictionary containing information about
-        connections to which state updates are currently in progress.  The keys
-        are protocol instances.  The values are ``_UpdateState`` instances.
+    Information about the state update in progress to a connection and the
+    generations the connection last acknowledged are kept on the connection
+    itself, in its ``_update_state`` and ``_last_received_generation``
+    attributes (see ``ControlAMP``).
+
     :ivar IReactorTime _reactor: An ``IReactorTime`` provider to be used to
         schedule delays in sending updates.
     :ivar set _connections_pending_update: A ``set`` of connections that are
         currently pending getting an update of state and configuration. An
-        empty set indicates that there is no update pending.
+        empty set indicates that there is no update pending, unless
+        ``_broadcast_pending`` is set.
+    :ivar bool _broadcast_pending: Whether all connections are pending getting
+        an update of state and configuration, in addition to those in
+        ``_connections_pending_update``.
     :ivar IDelayedCall _current_pending_update_delayed_call: The
         ``IDelayedCall`` provider for the currently pending call to update
         state/configuration on connected nodes.
@@ -626,11 +956,8 @@ class ControlAMPService(Service):
         self._connections = set()
         self._reactor = reactor
         self._connections_pending_update = set()
+        self._broadcast_pending = False
         self._current_pending_update_delayed_call = None
-        self._current_command = {}
-        self._last_received_generation = defaultdict(
-            lambda: _ConfigAndStateGeneration()
-        )
         self._configuration_generation_tracker = GenerationTracker(100)
         self._state_generation_tracker = GenerationTracker(100)
         self.cluster_state = cluster_state
@@ -675,13 +1002,14 @@ class ControlAMPService(Service):
         # See https://clusterhq.atlassian.net/browse/FLOC-3140 for some
         # brainstorming.
 
-        # Collect connections for which there is currently no unacknowledged
-        # update.  These can receive a new update right away.
+        # Collect connections for which there are fewer unacknowledged updates
+        # than we allow to be in flight.  These can receive a new update right
+        # away.
         can_update = []
 
-        # Collect connections for which there is an unacknowledged update.
-        # Since something has changed, these should receive another update once
-        # that acknowledgement is received.
+        # Collect connections for which as many updates as we allow are
+        # unacknowledged.  Since something has changed, these should receive
+        # another update once the oldest acknowledgement is received.
         delayed_update = []
 
         # Collect connections which were already set to receive a delayed
@@ -691,16 +1019,16 @@ class ControlAMPService(Service):
         elided_update = []
 
         for connection in connections:
-            try:
-                update = self._current_command[connection]
-            except KeyError:
-                # There's nothing in the tracking state for this connection.
-                # That means there's no unacknowledged update.  That means we
-                # can send another update right away.
+            update = connection._update_state
+            if (update is None or len(update.responses) <
+                    CONTROL_SERVICE_MAX_UPDATES_IN_FLIGHT):
+                # There's nothing in the tracking state for this connection, or
+                # there's room for another unacknowledged update.  That means
+                # we can send another update right away.
                 can_update.append(connection)
             else:
-                # These connections do currently have an unacknowledged update
-                # outstanding.
+                # These connections do currently have as many unacknowledged
+                # updates outstanding as they are allowed.
                 if update.next_scheduled:
                     # And these connections are also already scheduled to
                     # receive another update after the one they're currently
@@ -713,28 +1041,53 @@ class ControlAMPService(Service):
                     # schedule one.
                     delayed_update.append(connection)
 
-        # Make sure to run the logging action inside the caching block.
-        # This lets encoding for logging share the cache with encoding for
-        # network traffic.
         with LOG_SEND_CLUSTER_STATE() as action:
             if can_update:
                 # If there are any protocols that can be updated right now,
-                # we also want to see what updates they receive.  Since
-                # logging shares the caching context, it shouldn't be any
-                # more expensive to serialize this information into the log
-                # now.  We specifically avoid logging this information if
-                # no protocols are being updated because the serializing is
-                # more expensive in that case and at the same time that
-                # information isn't actually useful.
+                # we also want to see what updates they receive.  Encoding
+                # them once here also fills the cache used for network
+                # traffic, so it shouldn't be any more expensive to log this
+                # information now.  We specifically avoid logging this
+                # information if no protocols are being updated because the
+                # serializing is more expensive in that case and at the same
+                # time that information isn't actually useful.
                 action.add_success_fields(
-                    configuration=configuration, state=state
+                    configuration=caching_wire_encode(configuration),
+                    state=caching_wire_encode(state),
                 )
             else:
                 # Eliot wants those fields though.
                 action.add_success_fields(configuration=None, state=None)
 
+            if can_update:
+                # Set the configuration and the state to the latest versions
+                # once for all connections being updated.  It is okay to call
+                # this even if the latest configuration is the same object.
+                config_gen_tracker = self._configuration_generation_tracker
+                state_gen_tracker = self._state_generation_tracker
+                config_gen_tracker.insert_latest(configuration)
+                state_gen_tracker.insert_latest(state)
+                configuration_generation = config_gen_tracker.get_latest_hash()
+                state_generation = state_gen_tracker.get_latest_hash()
+                latest_generations = _ConfigAndStateGeneration(
+                    config_hash=configuration_generation,
+                    state_hash=state_generation,
+                )
+
             for connection in can_update:
-                self._update_connection(connection, configuration, state)
+                # Don't bother sending an update which would not change
+                # anything for the agent.
+                update = connection._update_state
+                if update is None:
+                    known_generations = connection._last_received_generation
+                else:
+                    known_generations = update.sent_generations
+                if known_generations == latest_generations:
+                    AGENT_UPDATE_UNNECESSARY(agent=connection).write()
+                    continue
+                self._update_connection(
+                    connection, configuration_generation, state_generation
+                )
 
             for connection in elided_update:
                 AGENT_UPDATE_ELIDED(agent=connection).write()
@@ -742,27 +1095,35 @@ class ControlAMPService(Service):
             for connection in delayed_update:
                 self._delayed_update_connection(connection)
 
-    def _update_connection(self, connection, configuration, state):
+    def _update_connection(self, connection, configuration_generation,
+                           state_generation):
         """
         Send the latest cluster configuration and state to ``connection``.
 
+        The latest configuration and state must already have been inserted
+        into the generation trackers.  If there are updates to ``connection``
+        in progress, the update is computed relative to the newest of them:
+        the agent processes the updates in the order they are sent.
+
         :param ControlAMP connection: The connection to use to send the
             command.
+        :param GenerationHash configuration_generation: The generation hash
+            of the latest configuration.
+        :param GenerationHash state_generation: The generation hash of the
+            latest state.
         """
-
-        # Set the configuration and the state to the latest versions. It is
-        # okay to call this even if the latest configuration is the same
-        # object.
-        self._configuration_generation_tracker.insert_latest(configuration)
-        self._state_generation_tracker.insert_latest(state)
-
         action = LOG_SEND_TO_AGENT(agent=connection)
         with action.context():
 
             # Attempt to compute a diff to send to the connection
-            last_received_generations = (
-                self._last_received_generation[connection]
-            )
+            update = connection._update_state
+            if update is None:
+                last_received_generations = (
+                    connection._last_received_generation
+                )
+                update = connection._update_state = _UpdateState()
+            else:
+                last_received_generations = update.sent_generations
 
             config_gen_tracker = self._configuration_generation_tracker
             configuration_diff = (
@@ -789,14 +1150,12 @@ class ControlAMPService(Service):
                     start_configuration_generation=(
                         last_received_generations.config_hash
                     ),
-                    end_configuration_generation=(
-                        config_gen_tracker.get_latest_hash()
-                    ),
+                    end_configuration_generation=configuration_generation,
                     state_diff=state_diff,
                     start_state_generation=(
                         last_received_generations.state_hash
                     ),
-                    end_state_generation=state_gen_tracker.get_latest_hash(),
+                    end_state_generation=state_generation,
                     eliot_context=action
                 ))
                 d.addActionFinish()
@@ -811,56 +1170,72 @@ class ControlAMPService(Service):
                     connection.callRemote,
                     ClusterStatusCommand,
                     configuration=configuration,
-                    configuration_generation=(
-                        config_gen_tracker.get_latest_hash()
-                    ),
+                    configuration_generation=configuration_generation,
                     state=state,
-                    state_generation=state_gen_tracker.get_latest_hash(),
+                    state_generation=state_generation,
                     eliot_context=action
                 ))
                 d.addActionFinish()
             d.result.addErrback(lambda _: None)
 
-        update = self._current_command[connection] = _UpdateState(
-            response=d.result,
-            next_scheduled=False,
+        result = d.result
+        update.responses.append(result)
+        update.sent_generations = _ConfigAndStateGeneration(
+            config_hash=configuration_generation,
+            state_hash=state_generation,
         )
 
         def finished_update(response):
-            del self._current_command[connection]
+            update.responses.remove(result)
+            if not response:
+                # The update failed, so it may never have reached the agent,
+                # and any update sent after it may have been computed
+                # relative to it.  Or the agent rejected a diff because it
+                # did not produce the expected generations, in which case
+                # sending the same diff again would not help either.  What
+                # the agent will have is unknown, so don't skip the next
+                # update and send it in full.
+                update.sent_generations = _NO_GENERATIONS
+                connection._last_received_generation = _NO_GENERATIONS
+            remaining = update.responses
+            if remaining:
+                # Any update scheduled to follow the oldest one has now been
+                # scheduled (see ``_delayed_update_connection``).
+                update.next_scheduled = False
+            elif connection._update_state is update:
+                connection._update_state = None
             if response:
-                config_gen = response['current_configuration_generation']
-                state_gen = response['current_state_generation']
-                self._last_received_generation[connection] = (
-                    _ConfigAndStateGeneration(
-                        config_hash=config_gen,
-                        state_hash=state_gen
-                    )
-                )
-                #  If the latest hash was not returned, schedule an update.
-                if (self._configuration_generation_tracker.get_latest_hash() !=
-                        config_gen or
-                        self._state_generation_tracker.get_latest_hash() !=
-                        state_gen):
+                # Responses arrive in the order the updates were sent, so this
+                # is the newest acknowledgement.
+                generations = response['current_generations']
+                connection._last_received_generation = generations
+                # If the latest hash was not returned once every update has
+                # been acknowledged, schedule an update.
+                if not remaining and (
+                        self._configuration_generation_tracker
+                        .get_latest_hash() != generations.config_hash or
+                        self._state_generation_tracker
+                        .get_latest_hash() != generations.state_hash):
                     self._schedule_update([connection])
-        update.response.addCallback(finished_update)
+        result.addCallback(finished_update)
 
     def _delayed_update_connection(self, connection):
         """
         Send a ``ClusterStatusCommand`` to an agent after it has acknowledged
-        the last one.
+        the oldest one in progress.
 
         :param ControlAMP connection: The connection to use to send the
             command.  This connection is expected to have previously been sent
-            such a command and to not yet have acknowledged it.  Internal state
-            related to this will be used and then updated.
+            as many such commands as are allowed in flight and to not yet have
+            acknowledged them.  Internal state related to this will be used
+            and then updated.
         """
         AGENT_UPDATE_DELAYED(agent=connection).write()
-        update = self._current_command[connection]
-        update.response.addCallback(
+        update = connection._update_state
+        update.responses[0].addCallback(
             lambda ignored: self._schedule_update([connection]),
         )
-        self._current_command[connection] = update.set(next_scheduled=True)
+        update.next_scheduled = True
 
     def connected(self, connection):
         """
@@ -869,6 +1244,8 @@ class ControlAMPService(Service):
         :param ControlAMP connection: The new connection.
         """
         with AGENT_CONNECTED(agent=connection):
+            connection._update_state = None
+            connection._last_received_generation = _NO_GENERATIONS
             self._connections.add(connection)
             self._schedule_update([connection])
 
@@ -881,15 +1258,23 @@ class ControlAMPService(Service):
         self._connections.remove(connection)
         if connection in self._connections_pending_update:
             self._connections_pending_update.remove(connection)
-        if connection in self._last_received_generation:
-            del self._last_received_generation[connection]
+        connection._last_received_generation = _NO_GENERATIONS
 
     def _execute_update_connections(self):
         """
         Actually executes an update to all pending connections.
         """
-        connections_to_update = self._connections_pending_update
-        self._connections_pending_update = set()
+        if self._broadcast_pending:
+            # Every connection pending an update is in here too.
+            # ``_send_state_to_connections`` sorts the connections into
+            # lists before sending anything, so connections lost while
+            # sending do not disturb its iteration.
+            connections_to_update = self._connections
+            self._connections_pending_update.clear()
+            self._broadcast_pending = False
+        else:
+            connections_to_update = self._connections_pending_update
+            self._connections_pending_update = set()
         self._current_pending_update_delayed_call = None
         self._send_state_to_connections(connections_to_update)
 
@@ -903,13 +1288,20 @@ class ControlAMPService(Service):
         :param connections: An iterable of connections that will be passed to
             ``_send_state_to_connections``.
         """
-        self._connections_pending_update.update(set(connections))
+        self._connections_pending_update.update(connections)
+        self._schedule_pending_update()
 
+    def _schedule_pending_update(self):
+        """
+        Schedule a call to ``_execute_update_connections`` if there are
+        connections pending an update and no call is scheduled yet.
+        """
         # If there is no current pending update and there are connections
         # pending an update, we must schedule the delayed call to update
         # connections.
         if (self._current_pending_update_delayed_call is None
-                and self._connections_pending_update):
+                and (self._broadcast_pending or
+                     self._connections_pending_update)):
             self._current_pending_update_delayed_call = (
                 self._reactor.callLater(
                     CONTROL_SERVICE_BATCHING_DELAY,
@@ -928,7 +1320,11 @@ class ControlAMPService(Service):
         so that if we receive multiple updates within that second they are
         coalesced down to a single update.
         """
-        self._schedule_update(self._connections)
+        # Rather than copying every connection into the set of pending
+        # connections, just note that they are all pending:
+        if self._connections:
+            self._broadcast_pending = True
+            self._schedule_pending_update()
 
     def node_changed(self, source, state_changes):
         """
@@ -986,20 +1382,42 @@ class _AgentLocator(CommandLocator):
     :ivar _current_state: The current state of the cluster.
     :ivar GenerationHash _current_state_generation: The current generation hash
         of the state.
+    :ivar bool _verify_diffs: Whether to verify the hashes of configurations
+        and states produced by applying diffs.
+    :ivar _generations_response: The response built by
+        ``_current_generations_response`` for the current generations, or
+        ``None`` if it has not been built yet.
     """
-    def __init__(self, agent, timeout):
+    # There is one of these for every agent connection:
+    __slots__ = (
+        'agent', '_timeout', '_verify_diffs',
+        '_current_configuration', '_current_configuration_generation',
+        '_current_state', '_current_state_generation',
+        '_generations_response',
+    )
+
+    def __init__(self, agent, timeout, verify_diffs=True):
         """
         :param IConvergenceAgent agent: Convergence agent to notify of changes.
         :param Timeout timeout: A ``Timeout`` object to reset when a message
             is received.
+        :param bool verify_diffs: If ``True``, hash the configuration and
+            state resulting from each ``ClusterStatusDiffCommand`` and check
+            them against the expected generation hashes.  If ``False``, the
+            expected hashes are trusted instead, which saves hashing the
+            whole cluster for every diff, but a diff which produces the wrong
+            result then goes unnoticed.  ``ClusterStatusCommand`` is always
+            verified.
         """
         CommandLocator.__init__(self)
         self.agent = agent
         self._timeout = timeout
+        self._verify_diffs = verify_diffs
         self._current_configuration = None
         self._current_configuration_generation = None
         self._current_state = None
         self._current_state_generation = None
+        self._generations_response = None
 
     def locateResponder(self, name):
         """
@@ -1022,40 +1440,19 @@ class _AgentLocator(CommandLocator):
         """
         return self.agent.logger
 
-    def _set_configuration(self, configuration, verify_hash):
-        """
-        Set the configuration, and verify that the hash of the configuration is
-        correct.
-
-        :param configuration: The new configuration.
-        :param verify_hash: The expected generation hash of the new
-            configuration.
-
-        :raises: ValueError if the new configuration does not have the
-            specified hash.
+    def _verify_hash(self, value, verify_hash):
         """
-        candidate_hash = make_generation_hash(configuration)
-        if candidate_hash != verify_hash:
-            raise ValueError('Bad hash value %s is not %s' % (candidate_hash,
-                                                              verify_hash))
-        self._current_configuration = configuration
-        self._current_configuration_generation = candidate_hash
-
-    def _set_state(self, state, verify_hash):
-        """
-        Set the state, and verify that the hash of the state is correct.
+        Verify that the hash of a new configuration or state is correct.
 
-        :param state: The new state.
-        :param verify_hash: The expected generation hash of the new state.
+        :param value: The new configuration or state.
+        :param verify_hash: The expected generation hash of ``value``.
 
-        :raises: ValueError if the new state does not have the specified hash.
+        :raises: ValueError if ``value`` does not have the specified hash.
         """
-        candidate_hash = make_generation_hash(state)
+        candidate_hash = make_generation_hash(value)
         if candidate_hash != verify_hash:
-            raise ValueError('Bad hash value %s is not %s' % (candidate_hash,
-                                                              verify_hash))
-        self._current_state = state
-        self._current_state_generation = candidate_hash
+            raise ValueError('Bad hash value %s is not %s' % (
+                candidate_hash, verify_hash))
 
     def _current_generations_response(self):
         """
@@ -1064,16 +1461,17 @@ class _AgentLocator(CommandLocator):
 
         :returns: A dict that has the current hash generations of the
             configuration and state, in the form expected for communication
-            back to the control node.
-        """
-        return {
-            'current_configuration_generation': (
-                self._current_configuration_generation
-            ),
-            'current_state_generation': (
-                self._current_state_generation
-            ),
-        }
+            back to the control node.  The same dict is returned until the
+            configuration or state changes, so it must not be modified.
+        """
+        if self._generations_response is None:
+            self._generations_response = {
+                'current_generations': _ConfigAndStateGeneration(
+                    config_hash=self._current_configuration_generation,
+                    state_hash=self._current_state_generation,
+                ),
+            }
+        return self._generations_response
 
     def _update_agent(self):
         """
@@ -1086,20 +1484,35 @@ class _AgentLocator(CommandLocator):
         )
 
     def _update_cluster(self, configuration, configuration_generation,
-                        state, state_generation):
+                        state, state_generation, verify=True):
         """
         Set the local configuration and state variables, and notify the agent
         of the update.
 
+        Both hashes are verified before either variable is set, so a bad
+        update leaves the configuration and state as they were.
+
         :param configuration: The new configuration.
         :param configuration_generation: The expected resulting generation hash
             of the new configuration.
         :param state: The new state.
         :param state_generation: The expected resulting generation hash of the
             new state.
+        :param bool verify: If ``False``, trust the expected generation hashes
+            rather than computing the hashes of ``configuration`` and
+            ``state``.
+
+        :raises: ValueError if the new configuration or state does not have
+            the specified hash.
         """
-        self._set_configuration(configuration, configuration_generation)
-        self._set_state(state, state_generation)
+        if verify:
+            self._verify_hash(configuration, configuration_generation)
+            self._verify_hash(state, state_generation)
+        self._current_configuration = configuration
+        self._current_configuration_generation = configuration_generation
+        self._current_state = state
+        self._current_state_generation = state_generation
+        self._generations_response = None
         self._update_agent()
 
     @ClusterStatusCommand.responder
@@ -1135,8 +1548,9 @@ class _AgentLocator(CommandLocator):
     ):
         """
         Responder to ``ClusterStatusDiffCommand``. Updates the configuration
-        and state by applying diffs to the current values, and verifies the
-        hash of the resulting objects.
+        and state by applying diffs to the current values, and, unless
+        ``verify_diffs`` was ``False``, verifies the hash of the resulting
+        objects.
 
         :param eliot_context: The eliot context this is called under.
         :param configuration_diff: The diff from the current configuration to
@@ -1152,25 +1566,26 @@ class _AgentLocator(CommandLocator):
             state after the diff is applied.
         """
         with eliot_context:
-            if (start_configuration_generation !=
-                    self._current_configuration_generation):
-                return self._current_generations_response()
-            if (start_state_generation !=
+            # The diffs only apply to the configuration and state they were
+            # computed from.  If this node has something else, ignore them
+            # and just tell the control service what this node does have.
+            if (start_configuration_generation ==
+                    self._current_configuration_generation and
+                    start_state_generation ==
                     self._current_state_generation):
-                return self._current_generations_response()
-
-            new_configuration = configuration_diff.apply(
-                self._current_configuration
-            )
-            new_state = state_diff.apply(
-                self._current_state
-            )
-            self._update_cluster(
-                new_configuration,
-                end_configuration_generation,
-                new_state,
-                end_state_generation
-            )
+                new_configuration = configuration_diff.apply(
+                    self._current_configuration
+                )
+                new_state = state_diff.apply(
+                    self._current_state
+                )
+                self._update_cluster(
+                    new_configuration,
+                    end_configuration_generation,
+                    new_state,
+                    end_state_generation,
+                    verify=self._verify_diffs,
+                )
             return self._current_generations_response()
 
 
@@ -1195,6 +1610,15 @@ class AgentAMP(AMP):
         self.agent = agent
         self._pinger = Pinger(reactor)
 
+    def callRemote(self, command, **kwargs):
+        """
+        Send a command to the peer, postponing the next ping.
+
+        See ``AMP.callRemote`` for argument and return value documentation.
+        """
+        self._pinger.sent()
+        return AMP.callRemote(self, command, **kwargs)
+
     def connectionMade(self):
         AMP.connectionMade(self)
         self.agent.connected(self)
@@ -1209,29 +1633,50 @@ class AgentAMP(AMP):
 
 class Pinger(object):
     """
-    An periodic AMP ping helper.
+    An AMP ping helper which pings a peer when a protocol has not sent it any
+    other command for a while.
+
+    Any command resets the peer's timeout (see ``timeout_for_protocol``), so
+    there is no need to ping a peer which is being sent other commands.
     """
+    # There is one of these for every connection:
+    __slots__ = ('reactor', '_last_sent', '_pinging')
+
     def __init__(self, reactor):
         """
         :param IReactorTime reactor: The reactor to use to schedule the pings.
         """
         self.reactor = reactor
+        self._last_sent = None
+
+    def sent(self):
+        """
+        Note that a command has just been sent to the peer.
+        """
+        self._last_sent = self.reactor.seconds()
 
     def start(self, protocol, interval):
         """
         Start sending some pings.
 
         :param AMP protocol: The protocol over which to send the pings.
-        :param timedelta interval: The interval at which to send the pings.
+        :param timedelta interval: The longest time to go without sending a
+            command before sending a ping.
         """
+        interval = interval.total_seconds()
+
         def ping():
-            protocol.callRemote(NoOp)
-        self._pinging = LoopingCall(ping)
-        self._pinging.clock = self.reactor
-        self._pinging.start(interval.total_seconds(), now=False)
+            idle = self.reactor.seconds() - self._last_sent
+            if idle >= interval:
+                protocol.callRemote(NoOp)
+                self.sent()
+                idle = 0
+            self._pinging = self.reactor.callLater(interval - idle, ping)
+        self.sent()
+        self._pinging = self.reactor.callLater(interval, ping)
 
     def stop(self):
         """
         Stop sending the pings.
         """
-        self._pinging.stop()
+        self._pinging.cancel()
@@ -40,6 +40,14 @@ class DiffTestObj(PClass):
     a = field()
 
 
+class OtherDiffTestObj(PClass):
+    """
+    Simple pyrsistent object for testing, with the same fields as
+    ``DiffTestObj``.
+    """
+    a = field()
+
+
 class DeploymentDiffTest(TestCase):
     """
     Tests for creating and applying diffs between deployments.
@@ -196,6 +204,69 @@ class DeploymentDiffTest(TestCase):
             Equals(object_b)
         )
 
+    def test_different_pclass_types(self):
+        """
+        Diffing ``PClass`` instances of different types that have the same
+        fields results in a diff that replaces the object rather than one that
+        sets the fields of the original object.
+        """
+        object_a = pmap({'x': DiffTestObj(a=1)})
+        object_b = pmap({'x': OtherDiffTestObj(a=2)})
+        diff = create_diff(object_a, object_b)
+        self.assertThat(
+            type(diff.apply(object_a)['x']),
+            Equals(OtherDiffTestObj)
+        )
+
+    def test_changes_shared(self):
+        """
+        Equal changes computed by different diffs are the same object.
+        """
+        object_a = pmap({'a': pset([1, 2])})
+        object_b = pmap({'a': pset([2, 3])})
+        diff_1 = create_diff(object_a, object_b)
+        diff_2 = create_diff(object_a, object_b)
+        self.assertEqual(
+            [True] * len(diff_1.changes),
+            [change_1 is change_2 for change_1, change_2
+             in zip(diff_1.changes, diff_2.changes)]
+        )
+
+    def test_equal_values_of_other_types_kept(self):
+        """
+        A change to a value which is equal to the value of a change in use by
+        another diff, but of a different type, keeps its own type.
+        """
+        original = pmap({'k': 0, 'v': None})
+        other_diff = create_diff(original, pmap({'k': True, 'v': b'x'}))
+        diff = create_diff(original, pmap({'k': 1, 'v': u'x'}))
+        result = diff.apply(original)
+        self.assertEqual(
+            (int, unicode),
+            (type(result['k']), type(result['v'])),
+        )
+        # Keep the other diff, and so its changes, alive until here:
+        del other_diff
+
+    def test_equal_nested_values_of_other_types_kept(self):
+        """
+        A change to a value which is equal to the value of a change in use by
+        another diff, but contains values of different types, keeps the
+        types of the values it contains.
+        """
+        original = pmap({u'n': None, u's': None})
+        other_diff = create_diff(
+            original, pmap({u'n': pmap({u'v': 1}), u's': pset([b'abc'])}))
+        diff = create_diff(
+            original, pmap({u'n': pmap({u'v': True}), u's': pset([u'abc'])}))
+        result = diff.apply(original)
+        self.assertEqual(
+            (bool, [unicode]),
+            (type(result[u'n'][u'v']), [type(item) for item in result[u's']]),
+        )
+        # Keep the other diff, and so its changes, alive until here:
+        del other_diff
+
     def test_different_uuids(self):
         """
         Diffing objects that have parts that are simply not equal can be
@@ -389,6 +460,26 @@ class TransformProxyTests(TestCase):
         original = pmap()
         self.assertIs(original, _TransformProxy(original).commit())
 
+    def test_commit_unchanged_child(self):
+        """
+        ``commit`` returns the original object if child objects were traversed
+        but not changed.
+        """
+        original = pmap({'a': pmap({'b': pset([1])})})
+        proxy = _TransformProxy(original)
+        proxy.target(['a', 'b'])
+        self.assertIs(original, proxy.commit())
+
+    def test_remove_added_child(self):
+        """
+        Removing a key whose value was only set on the proxy leaves the
+        original object unchanged.
+        """
+        original = pmap({'a': 1})
+        proxy = _TransformProxy(original)
+        proxy.target([]).set('b', pmap()).remove('b')
+        self.assertIs(original, proxy.commit())
+
     def test_transform_keyerror(self):
         """
         ``transform`` raises ``KeyError`` if the supplied ``path`` is not
@@ -460,6 +551,49 @@ class TransformProxyTests(TestCase):
             proxy.commit(),
         )
 
+    def test_target(self):
+        """
+        ``target`` returns the proxy for the object at the supplied ``path``,
+        and operations on it are applied when the proxy is committed.
+        """
+        proxy = _TransformProxy(pmap({'a': pmap({'b': 1})}))
+        proxy.target(['a']).set('b', 2)
+        self.assertEqual(
+            pmap({'a': pmap({'b': 2})}),
+            proxy.commit(),
+        )
+
+    def test_target_replaced(self):
+        """
+        ``target`` returns the proxy for the current object at the supplied
+        ``path`` even if an object on that path was replaced since the path
+        was last used.
+        """
+        proxy = _TransformProxy(pmap({'a': pmap({'b': pmap({'c': 1})})}))
+        proxy.target(['a', 'b']).set('c', 2)
+        proxy.target(['a']).set('b', pmap({'d': 3}))
+        proxy.target(['a', 'b']).set('e', 4)
+        self.assertEqual(
+            pmap({'a': pmap({'b': pmap({'d': 3, 'e': 4})})}),
+            proxy.commit(),
+        )
+
+    def test_target_siblings(self):
+        """
+        ``target`` returns the proxy for the object at the supplied ``path``
+        when consecutive paths share only a prefix.
+        """
+        proxy = _TransformProxy(
+            pmap({'a': pmap({'b': pmap({'x': 1}), 'c': pmap({'x': 1})})})
+        )
+        proxy.target(['a', 'b']).set('x', 2)
+        proxy.target(['a', 'c']).set('x', 3)
+        proxy.target(['a']).remove('b')
+        self.assertEqual(
+            pmap({'a': pmap({'c': pmap({'x': 3})})}),
+            proxy.commit(),
+        )
+
     def test_transform_deep_evolver(self):
         """
         ``transform`` can perform operations on nested objects that have
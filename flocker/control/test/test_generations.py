@@ -99,3 +99,28 @@ class GenerationTrackerTests(TestCase):
             missing_diff,
             Is(None)
         )
+
+    def test_diff_reused(self):
+        """
+        ``get_diff_from_hash_to_latest`` returns the same ``Diff`` object for
+        the same generation hash until a new latest object is inserted.
+        """
+        deployments = related_deployments_strategy(3).example()
+        tracker_under_test = GenerationTracker(4)
+        for d in deployments[:2]:
+            tracker_under_test.insert_latest(d)
+        generation_hash = make_generation_hash(deployments[0])
+
+        diff = tracker_under_test.get_diff_from_hash_to_latest(
+            generation_hash)
+        self.assertThat(
+            tracker_under_test.get_diff_from_hash_to_latest(generation_hash),
+            Is(diff)
+        )
+
+        tracker_under_test.insert_latest(deployments[2])
+        self.assertThat(
+            tracker_under_test.get_diff_from_hash_to_latest(
+                generation_hash).apply(deployments[0]),
+            Equals(deployments[2])
+        )
@@ -34,7 +34,8 @@ from .._persistence import (
     _LOG_SAVE, _LOG_STARTUP, migrate_configuration,
     _CONFIG_VERSION, ConfigurationMigration, ConfigurationMigrationError,
     _LOG_UPGRADE, MissingMigrationError, update_leases, _LOG_EXPIRE,
-    _LOG_UNCHANGED_DEPLOYMENT_NOT_SAVED, to_unserialized_json, generation_hash
+    _LOG_UNCHANGED_DEPLOYMENT_NOT_SAVED, to_unserialized_json, generation_hash,
+    make_generation_hash, _make_generation_hash_cache,
     )
 from .._model import (
     Deployment, Application, DockerImage, Node, Dataset, Manifestation,
@@ -973,3 +974,43 @@ class GenerationHashTests(TestCase):
             generation_hash(TEST_DEPLOYMENT_2),
             Equals(TEST_DEPLOYMENT_2_HASH)
         )
+
+
+class MakeGenerationHashTests(TestCase):
+    """
+    Tests for ``make_generation_hash``.
+    """
+    def test_hash(self):
+        """
+        ``make_generation_hash`` wraps the ``generation_hash`` of an object in
+        a ``GenerationHash``.
+        """
+        self.assertThat(
+            make_generation_hash(TEST_DEPLOYMENT_1).hash_value,
+            Equals(tuple(ord(c) for c in generation_hash(TEST_DEPLOYMENT_1)))
+        )
+
+    def test_cached(self):
+        """
+        ``make_generation_hash`` returns the same ``GenerationHash`` when
+        called again with the same object.
+        """
+        first = make_generation_hash(TEST_DEPLOYMENT_1)
+        self.assertThat(
+            make_generation_hash(TEST_DEPLOYMENT_1),
+            Is(first)
+        )
+
+    def test_forgotten(self):
+        """
+        ``make_generation_hash`` does not keep objects it hashed alive, and
+        forgets their ``GenerationHash`` once they are collected.
+        """
+        deployment = Deployment(nodes={Node(uuid=uuid4())})
+        make_generation_hash(deployment)
+        cached = len(_make_generation_hash_cache)
+        del deployment
+        self.assertThat(
+            len(_make_generation_hash_cache),
+            Equals(cached - 1)
+        )
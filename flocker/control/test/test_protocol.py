@@ -4,8 +4,11 @@
 Tests for ``flocker.control._protocol``.
 """
 
+import gc
+from threading import Event, Thread
 from uuid import uuid4
 from json import loads
+from weakref import ref
 
 from zope.interface import implementer
 from zope.interface.verify import verifyObject
@@ -38,18 +41,22 @@ from ...testtools.amp import (
     LoopbackAMPClient, StringTransportWithAbort,
 )
 
+from .. import _protocol
 from .._protocol import (
     PING_INTERVAL, Big, SerializableArgument,
     VersionCommand, ClusterStatusCommand, ClusterStatusDiffCommand,
     NodeStateCommand, IConvergenceAgent, NoOp, AgentAMP, ControlAMP,
     _AgentLocator, ControlServiceLocator, LOG_SEND_CLUSTER_STATE,
     LOG_SEND_TO_AGENT, AGENT_CONNECTED, caching_wire_encode, SetNodeEraCommand,
-    timeout_for_protocol, CONTROL_SERVICE_BATCHING_DELAY
+    timeout_for_protocol, CONTROL_SERVICE_BATCHING_DELAY, _ShardedLRUCache,
+    _GenerationHashArgument, _GenerationHashPairArgument,
+    _ConfigAndStateGeneration, _NO_GENERATIONS,
 )
 from .. import (
     Deployment, Application, DockerImage, Node, NodeState, Manifestation,
     Dataset, DeploymentState, NonManifestDatasets,
 )
+from .._model import GenerationHash
 from .._persistence import wire_encode, make_generation_hash
 from .._diffing import create_diff
 from .clusterstatetools import advance_some, advance_rest
@@ -215,6 +222,16 @@ class BigArgumentTests(TestCase):
             ("big", Big(ListOf(Integer()))),
         ]
 
+    class CommandWithBigSerializableArgument(Command):
+        arguments = [
+            ("big", Big(SerializableArgument(list, tuple))),
+        ]
+
+    class CommandWithOtherBigSerializableArgument(Command):
+        arguments = [
+            ("large", Big(SerializableArgument(list, tuple))),
+        ]
+
     def test_interface(self):
         """
         ``Big`` instances provide ``IArgumentType``.
@@ -240,6 +257,12 @@ class BigArgumentTests(TestCase):
         some_list = range(10)
         self.assert_roundtrips(self.CommandWithBigListArgument, big=some_list)
 
+    def test_roundtrip_empty(self):
+        """
+        ``Big`` can serialize and unserialize an empty argument.
+        """
+        self.assert_roundtrips(self.CommandWithBigArgument, big=b"")
+
     def test_roundtrip_small(self):
         """
         ``Big`` can serialize and unserialize argmuments which are smaller then
@@ -269,6 +292,17 @@ class BigArgumentTests(TestCase):
 
         self.assert_roundtrips(self.CommandWithBigArgument, big=big_bytes)
 
+    def test_roundtrip_many_chunks(self):
+        """
+        ``Big`` reassembles values split into more than ten chunks in the
+        right order, where the chunk keys do not sort the same way as their
+        indexes.
+        """
+        many_bytes = b"".join(
+            bytes(i % 10) * MAX_VALUE_LENGTH for i in range(12)
+        )
+        self.assert_roundtrips(self.CommandWithBigArgument, big=many_bytes)
+
     def test_two_big_arguments(self):
         """
         AMP can serialize and unserialize a ``Command`` with multiple ``Big``
@@ -291,6 +325,35 @@ class BigArgumentTests(TestCase):
             regular=b"goodbye world",
         )
 
+    def test_roundtrip_serializable(self):
+        """
+        ``Big`` wrapping a ``SerializableArgument`` can serialize and
+        unserialize an object whose encoding is larger than AMP's
+        MAX_VALUE_LENGTH.
+        """
+        command = self.CommandWithBigSerializableArgument
+        value = (u"x" * MAX_VALUE_LENGTH, u"y")
+        argument_box = command.makeArguments({"big": value}, None)
+        [roundtripped] = parseString(argument_box.serialize())
+        self.assertEqual(
+            {"big": list(value)}, command.parseArguments(roundtripped, None))
+
+    def test_serializable_chunks_cached(self):
+        """
+        The chunks of an object serialized by ``Big`` wrapping a
+        ``SerializableArgument`` are cached along with its encoding, so
+        sending it again, under any name, reuses the same chunk objects.
+        """
+        value = (u"x" * MAX_VALUE_LENGTH, u"y")
+        first = self.CommandWithBigSerializableArgument.makeArguments(
+            {"big": value}, None)
+        second = self.CommandWithOtherBigSerializableArgument.makeArguments(
+            {"large": value}, None)
+        self.assertEqual(
+            [True, True],
+            [first[b"big." + index] is second[b"large." + index]
+             for index in (b"0", b"1")])
+
 
 class SerializationTests(TestCase):
     """
@@ -378,6 +441,86 @@ class SerializationTests(TestCase):
                       argument.toString(_TEST_DEPLOYMENT))
 
 
+class GenerationHashArgumentTests(TestCase):
+    """
+    Tests for ``_GenerationHashArgument``.
+    """
+    def test_roundtrip(self):
+        """
+        ``_GenerationHashArgument`` can round-trip a ``GenerationHash``,
+        which is sent as its raw hash bytes.
+        """
+        argument = _GenerationHashArgument()
+        generation = make_generation_hash(_TEST_DEPLOYMENT)
+        as_bytes = argument.toString(generation)
+        self.assertEqual(
+            [bytes, len(generation.hash_value), generation],
+            [type(as_bytes), len(as_bytes), argument.fromString(as_bytes)])
+
+    def test_roundtrip_none(self):
+        """
+        ``_GenerationHashArgument`` can round-trip a ``GenerationHash`` with
+        no hash value.
+        """
+        argument = _GenerationHashArgument()
+        generation = GenerationHash(hash_value=None)
+        self.assertEqual(
+            generation, argument.fromString(argument.toString(generation)))
+
+    def test_wrong_type_serialization(self):
+        """
+        ``_GenerationHashArgument`` throws a ``TypeError`` if one attempts to
+        serialize something other than a ``GenerationHash``.
+        """
+        argument = _GenerationHashArgument()
+        self.assertRaises(TypeError, argument.toString, _TEST_DEPLOYMENT)
+
+
+class GenerationHashPairArgumentTests(TestCase):
+    """
+    Tests for ``_GenerationHashPairArgument``.
+    """
+    def test_roundtrip(self):
+        """
+        ``_GenerationHashPairArgument`` can round-trip a
+        ``_ConfigAndStateGeneration``.
+        """
+        argument = _GenerationHashPairArgument()
+        generations = _ConfigAndStateGeneration(
+            config_hash=make_generation_hash(_TEST_DEPLOYMENT),
+            state_hash=make_generation_hash(NODE_STATE),
+        )
+        self.assertEqual(
+            generations, argument.fromString(argument.toString(generations)))
+
+    def test_roundtrip_none(self):
+        """
+        ``_GenerationHashPairArgument`` can round-trip a
+        ``_ConfigAndStateGeneration`` where either hash has no value.
+        """
+        argument = _GenerationHashPairArgument()
+        some_hash = make_generation_hash(_TEST_DEPLOYMENT)
+        no_hash = GenerationHash(hash_value=None)
+        pairs = [
+            _ConfigAndStateGeneration(config_hash=some_hash,
+                                      state_hash=no_hash),
+            _ConfigAndStateGeneration(config_hash=no_hash,
+                                      state_hash=some_hash),
+        ]
+        self.assertEqual(
+            pairs,
+            [argument.fromString(argument.toString(pair)) for pair in pairs])
+
+    def test_wrong_type_serialization(self):
+        """
+        ``_GenerationHashPairArgument`` throws a ``TypeError`` if one attempts
+        to serialize something other than a ``_ConfigAndStateGeneration``.
+        """
+        argument = _GenerationHashPairArgument()
+        self.assertRaises(
+            TypeError, argument.toString, make_generation_hash(NODE_STATE))
+
+
 class ControlTestCase(TestCase):
     """
     Base TestCase for control tests that supplies a utility
@@ -800,6 +943,161 @@ class ControlAMPServiceTests(ControlTestCase):
             agent.cluster_updated_count - initial_updates_count, 1
         )
 
+    def test_disconnected_forgets_generations(self):
+        """
+        Once a connection is lost, the generations it acknowledged are
+        forgotten.
+        """
+        agent = FakeAgent()
+        client = AgentAMP(Clock(), agent)
+        service_clock = Clock()
+        service = build_control_amp_service(self, service_clock)
+        service.startService()
+        server = LoopbackAMPClient(client.locator)
+        service.connected(server)
+        service_clock.advance(CONTROL_SERVICE_BATCHING_DELAY*2)
+        acknowledged = server._last_received_generation
+
+        service.disconnected(server)
+
+        self.assertEqual(
+            (True, _NO_GENERATIONS, None),
+            (acknowledged != _NO_GENERATIONS,
+             server._last_received_generation, server._update_state))
+
+    def test_pending_update_deadline_kept(self):
+        """
+        Updates scheduled while an update is already pending join it rather
+        than postponing it or scheduling another delayed call.
+        """
+        service_clock = Clock()
+        service = build_control_amp_service(self, service_clock)
+        service.startService()
+        servers = list(
+            LoopbackAMPClient(AgentAMP(Clock(), FakeAgent()).locator)
+            for _ in xrange(3))
+
+        service.connected(servers[0])
+        service_clock.advance(CONTROL_SERVICE_BATCHING_DELAY / 2)
+        service.connected(servers[1])
+        service.configuration_service.save(_TEST_DEPLOYMENT)
+        service.connected(servers[2])
+        calls = list(
+            call.getTime() for call in service_clock.calls
+            if call.func == service._execute_update_connections)
+
+        self.assertEqual([CONTROL_SERVICE_BATCHING_DELAY], calls)
+
+    def test_no_update_when_current(self):
+        """
+        A broadcast which does not change the configuration or state is not
+        sent to agents which have already acknowledged them.
+        """
+        agent = FakeAgent()
+        client = AgentAMP(Clock(), agent)
+        service_clock = Clock()
+        service = build_control_amp_service(self, service_clock)
+        service.startService()
+        server = LoopbackAMPClient(client.locator)
+        service.connected(server)
+        service_clock.advance(CONTROL_SERVICE_BATCHING_DELAY*2)
+
+        initial_updates_count = agent.cluster_updated_count
+        service._schedule_broadcast_update()
+        service_clock.advance(CONTROL_SERVICE_BATCHING_DELAY*2)
+
+        self.assertEqual(
+            agent.cluster_updated_count - initial_updates_count, 0
+        )
+
+    def test_update_after_failed_update(self):
+        """
+        If an update fails while a later one is in progress, a broadcast
+        which does not change the configuration or state is still sent to
+        the agent, since the agent may not have the generations it was sent.
+        """
+        agent = FakeAgent()
+        client = AgentAMP(Clock(), agent)
+        service_clock = Clock()
+        service = build_control_amp_service(self, service_clock)
+        service.startService()
+        delayed_server = DelayedAMPClient(LoopbackAMPClient(client.locator))
+        service.connected(delayed_server)
+        service_clock.advance(CONTROL_SERVICE_BATCHING_DELAY*2)
+        service.configuration_service.save(
+            arbitrary_transformation(service.configuration_service.get())
+        )
+        service_clock.advance(CONTROL_SERVICE_BATCHING_DELAY*2)
+
+        # Fail the first update while the second one is still in progress:
+        delayed_server.fail(Exception("Simulated failure"))
+
+        service._schedule_broadcast_update()
+        service_clock.advance(CONTROL_SERVICE_BATCHING_DELAY*2)
+
+        # The second update and the broadcast are both in progress:
+        delayed_server.respond()
+        delayed_server.respond()
+        self.assertRaises(IndexError, delayed_server.respond)
+
+    def test_full_update_after_rejected_diff(self):
+        """
+        If an agent rejects a diff because it does not produce the expected
+        generations, the next update sends the full configuration and state.
+        """
+        agent = FakeAgent()
+        client = AgentAMP(Clock(), agent)
+        service_clock = Clock()
+        service = build_control_amp_service(self, service_clock)
+        service.startService()
+        service.connected(LoopbackAMPClient(client.locator))
+        service_clock.advance(CONTROL_SERVICE_BATCHING_DELAY*2)
+
+        # Make the agent's configuration differ from the one its generation
+        # says it has, so that any diff to it produces the wrong result:
+        configuration = service.configuration_service.get()
+        client.locator._current_configuration = arbitrary_transformation(
+            configuration
+        )
+        modified_configuration = arbitrary_transformation(configuration)
+        service.configuration_service.save(modified_configuration)
+        service_clock.advance(CONTROL_SERVICE_BATCHING_DELAY*2)
+        rejected_agent_desired = agent.desired
+
+        service._schedule_broadcast_update()
+        service_clock.advance(CONTROL_SERVICE_BATCHING_DELAY*2)
+
+        self.assertEqual(
+            (configuration, modified_configuration),
+            (rejected_agent_desired, agent.desired),
+        )
+
+    def test_broadcast_and_single_update_coalesced(self):
+        """
+        A connection scheduled for an update on its own within the same
+        batching window as a broadcast only receives one update, and every
+        connection is updated by the broadcast.
+        """
+        agents = list(FakeAgent() for _ in xrange(3))
+        clients = list(AgentAMP(Clock(), agent) for agent in agents)
+        service_clock = Clock()
+        service = build_control_amp_service(self, service_clock)
+        service.startService()
+        servers = list(LoopbackAMPClient(client.locator) for client in clients)
+        for server in servers:
+            service.connected(server)
+        service_clock.advance(CONTROL_SERVICE_BATCHING_DELAY*2)
+
+        initial_counts = list(agent.cluster_updated_count for agent in agents)
+        service._schedule_update([servers[0]])
+        service.configuration_service.save(_TEST_DEPLOYMENT)
+        service_clock.advance(CONTROL_SERVICE_BATCHING_DELAY*2)
+
+        self.assertEqual(
+            [1, 1, 1],
+            list(agent.cluster_updated_count - initial
+                 for agent, initial in zip(agents, initial_counts)))
+
     def test_coalesce_delayed_updates(self):
         """
         If multiple clients still haven't acknowledged an update when a
@@ -864,10 +1162,12 @@ class ControlAMPServiceTests(ControlTestCase):
             list(agent.desired for agent in agents)
         )
 
-    def test_second_configuration_change_waits_for_first_acknowledgement(self):
+    def test_configuration_change_waits_for_oldest_acknowledgement(self):
         """
-        A second configuration change is only transmitted after acknowledgement
-        of the first configuration change is received.
+        A second configuration change is transmitted without waiting for
+        acknowledgement of the first, but once as many changes as are allowed
+        are in flight, the next one is only transmitted after acknowledgement
+        of the oldest configuration change is received.
         """
         agent = FakeAgent()
         client = AgentAMP(Clock(), agent)
@@ -885,6 +1185,9 @@ class ControlAMPServiceTests(ControlTestCase):
 
         configuration = service.configuration_service.get()
         modified_configuration = arbitrary_transformation(configuration)
+        more_modified_configuration = arbitrary_transformation(
+            modified_configuration
+        )
 
         server = LoopbackAMPClient(client.locator)
         delayed_server = DelayedAMPClient(server)
@@ -898,20 +1201,27 @@ class ControlAMPServiceTests(ControlTestCase):
         service_clock.advance(CONTROL_SERVICE_BATCHING_DELAY*2)
         second_agent_desired = agent.desired
 
-        delayed_server.respond()
+        # Send third update
+        service.configuration_service.save(more_modified_configuration)
         service_clock.advance(CONTROL_SERVICE_BATCHING_DELAY*2)
         third_agent_desired = agent.desired
 
+        delayed_server.respond()
+        service_clock.advance(CONTROL_SERVICE_BATCHING_DELAY*2)
+        fourth_agent_desired = agent.desired
+
         self.assertEqual(
             dict(
                 first=configuration,
-                second=configuration,
+                second=modified_configuration,
                 third=modified_configuration,
+                fourth=more_modified_configuration,
             ),
             dict(
                 first=first_agent_desired,
                 second=second_agent_desired,
                 third=third_agent_desired,
+                fourth=fourth_agent_desired,
             ),
         )
 
@@ -951,6 +1261,9 @@ class ControlAMPServiceTests(ControlTestCase):
 
         configuration = service.configuration_service.get()
         modified_configuration = arbitrary_transformation(configuration)
+        more_modified_configuration = arbitrary_transformation(
+            modified_configuration
+        )
 
         server = LoopbackAMPClient(client.locator)
         delayed_server = DelayedAMPClient(server)
@@ -961,30 +1274,36 @@ class ControlAMPServiceTests(ControlTestCase):
         # Send second update
         service.configuration_service.save(modified_configuration)
         service_clock.advance(CONTROL_SERVICE_BATCHING_DELAY*2)
-        second_agent_desired = agent.desired
 
-        delayed_server.respond()
+        # Send third update
+        service.configuration_service.save(more_modified_configuration)
         service_clock.advance(CONTROL_SERVICE_BATCHING_DELAY*2)
         third_agent_desired = agent.desired
 
+        delayed_server.respond()
+        service_clock.advance(CONTROL_SERVICE_BATCHING_DELAY*2)
+        fourth_agent_desired = agent.desired
+
         # Now we verify that the updates following the failure
         # actually worked as we expect
         self.assertEqual(
             dict(
-                first=configuration,
-                second=modified_configuration,
+                first=modified_configuration,
+                second=more_modified_configuration,
             ),
             dict(
-                # The update will fail, so we don't expect the config to change
-                first=second_agent_desired,
-                second=third_agent_desired,
+                # The third update waits for an acknowledgement, so we don't
+                # expect the config to change yet
+                first=third_agent_desired,
+                second=fourth_agent_desired,
             ),
         )
 
-    def test_third_configuration_change_supercedes_second(self):
+    def test_fourth_configuration_change_supercedes_third(self):
         """
-        A third configuration change completely replaces a second configuration
-        change if the first configuration change has not yet been acknowledged.
+        A fourth configuration change completely replaces a third configuration
+        change if the first configuration change has not yet been acknowledged
+        and the second one is in flight.
         """
         agent = FakeAgent()
         client = AgentAMP(Clock(), agent)
@@ -1005,6 +1324,9 @@ class ControlAMPServiceTests(ControlTestCase):
         more_modified_configuration = arbitrary_transformation(
             modified_configuration
         )
+        most_modified_configuration = arbitrary_transformation(
+            more_modified_configuration
+        )
 
         server = LoopbackAMPClient(client.locator)
         delayed_server = DelayedAMPClient(server)
@@ -1021,21 +1343,26 @@ class ControlAMPServiceTests(ControlTestCase):
         service.configuration_service.save(more_modified_configuration)
         service_clock.advance(CONTROL_SERVICE_BATCHING_DELAY*2)
 
+        # Send fourth update
+        service.configuration_service.save(most_modified_configuration)
+        service_clock.advance(CONTROL_SERVICE_BATCHING_DELAY*2)
+
         first_agent_desired = agent.desired
         delayed_server.respond()
         service_clock.advance(CONTROL_SERVICE_BATCHING_DELAY*2)
         second_agent_desired = agent.desired
         delayed_server.respond()
+        delayed_server.respond()
         third_agent_desired = agent.desired
 
-        # Only two calls should be required because only two states should be
-        # sent.  The intermediate state should never get sent.
+        # Only three calls should be required because only three states should
+        # be sent.  The third state should never get sent.
         self.assertRaises(IndexError, delayed_server.respond)
 
         self.assertEqual(
-            [configuration,
-             more_modified_configuration,
-             more_modified_configuration],
+            [modified_configuration,
+             most_modified_configuration,
+             most_modified_configuration],
             [first_agent_desired,
              second_agent_desired,
              third_agent_desired],
@@ -1203,11 +1530,9 @@ class AgentClientTests(TestCase):
         self.assertEqual(
             self.successResultOf(d),
             dict(
-                current_configuration_generation=make_generation_hash(
-                    _TEST_DEPLOYMENT
-                ),
-                current_state_generation=make_generation_hash(
-                    actual
+                current_generations=_ConfigAndStateGeneration(
+                    config_hash=make_generation_hash(_TEST_DEPLOYMENT),
+                    state_hash=make_generation_hash(actual),
                 ),
             )
         )
@@ -1233,11 +1558,9 @@ class AgentClientTests(TestCase):
         self.assertEqual(
             self.successResultOf(d),
             dict(
-                current_configuration_generation=make_generation_hash(
-                    next_deployment
-                ),
-                current_state_generation=make_generation_hash(
-                    next_state
+                current_generations=_ConfigAndStateGeneration(
+                    config_hash=make_generation_hash(next_deployment),
+                    state_hash=make_generation_hash(next_state),
                 ),
             )
         )
@@ -1269,11 +1592,9 @@ class AgentClientTests(TestCase):
         self.assertEqual(
             self.successResultOf(d),
             dict(
-                current_configuration_generation=make_generation_hash(
-                    _TEST_DEPLOYMENT
-                ),
-                current_state_generation=make_generation_hash(
-                    actual
+                current_generations=_ConfigAndStateGeneration(
+                    config_hash=make_generation_hash(_TEST_DEPLOYMENT),
+                    state_hash=make_generation_hash(actual),
                 ),
             )
         )
@@ -1292,11 +1613,9 @@ class AgentClientTests(TestCase):
         self.assertEqual(
             self.successResultOf(d),
             dict(
-                current_configuration_generation=make_generation_hash(
-                    _TEST_DEPLOYMENT
-                ),
-                current_state_generation=make_generation_hash(
-                    actual
+                current_generations=_ConfigAndStateGeneration(
+                    config_hash=make_generation_hash(_TEST_DEPLOYMENT),
+                    state_hash=make_generation_hash(actual),
                 ),
             )
         )
@@ -1313,11 +1632,9 @@ class AgentClientTests(TestCase):
         self.assertEqual(
             self.successResultOf(d),
             dict(
-                current_configuration_generation=make_generation_hash(
-                    next_deployment
-                ),
-                current_state_generation=make_generation_hash(
-                    next_state
+                current_generations=_ConfigAndStateGeneration(
+                    config_hash=make_generation_hash(next_deployment),
+                    state_hash=make_generation_hash(next_state),
                 ),
             )
         )
@@ -1328,6 +1645,129 @@ class AgentClientTests(TestCase):
                                                actual=next_state))
 
 
+class AgentLocatorDiffVerificationTests(TestCase):
+    """
+    Tests for the ``verify_diffs`` option of ``_AgentLocator``.
+    """
+    def setUp(self):
+        super(AgentLocatorDiffVerificationTests, self).setUp()
+        self.agent = FakeAgent()
+        self.state = DeploymentState(nodes=[])
+
+    def locator(self, **kwargs):
+        """
+        Create an ``_AgentLocator`` which already has ``_TEST_DEPLOYMENT``
+        and an empty state.
+        """
+        reactor = Clock()
+        protocol = AgentAMP(reactor, self.agent)
+        locator = _AgentLocator(
+            agent=self.agent, timeout=timeout_for_protocol(reactor, protocol),
+            **kwargs
+        )
+        locator.cluster_updated(
+            TEST_ACTION, _TEST_DEPLOYMENT,
+            make_generation_hash(_TEST_DEPLOYMENT),
+            self.state, make_generation_hash(self.state),
+        )
+        return locator
+
+    def send_bad_diff(self, locator):
+        """
+        Send a diff to ``locator`` whose end configuration generation does
+        not match the result of applying it.
+        """
+        next_deployment = arbitrary_transformation(_TEST_DEPLOYMENT)
+        wrong_generation = make_generation_hash(
+            arbitrary_transformation(next_deployment)
+        )
+        return locator.cluster_updated_diff(
+            TEST_ACTION,
+            configuration_diff=create_diff(_TEST_DEPLOYMENT, next_deployment),
+            start_configuration_generation=make_generation_hash(
+                _TEST_DEPLOYMENT
+            ),
+            end_configuration_generation=wrong_generation,
+            state_diff=create_diff(self.state, self.state),
+            start_state_generation=make_generation_hash(self.state),
+            end_state_generation=make_generation_hash(self.state),
+        ), next_deployment, wrong_generation
+
+    def test_trusted(self):
+        """
+        When ``verify_diffs`` is ``False``, the generations sent along with a
+        diff are trusted rather than verified.
+        """
+        locator = self.locator(verify_diffs=False)
+        response, next_deployment, wrong_generation = self.send_bad_diff(
+            locator
+        )
+        self.assertEqual(
+            (wrong_generation, next_deployment),
+            (response['current_generations'].config_hash,
+             self.agent.desired))
+
+    def test_verified(self):
+        """
+        By default a diff which does not produce the expected generation is
+        rejected.
+        """
+        locator = self.locator()
+        self.assertRaises(ValueError, self.send_bad_diff, locator)
+
+    def test_bad_state_unchanged_configuration(self):
+        """
+        If only the state of a ``ClusterStatusCommand`` has the wrong
+        generation, the configuration is not updated either.
+        """
+        locator = self.locator()
+        next_deployment = arbitrary_transformation(_TEST_DEPLOYMENT)
+        self.assertRaises(
+            ValueError,
+            locator.cluster_updated,
+            TEST_ACTION, next_deployment,
+            make_generation_hash(next_deployment),
+            self.state, make_generation_hash(next_deployment),
+        )
+        self.assertEqual(
+            make_generation_hash(_TEST_DEPLOYMENT),
+            locator._current_generations_response()[
+                'current_generations'].config_hash)
+
+    def test_stale_diff_response_reused(self):
+        """
+        Diffs which do not apply to the current configuration and state are
+        all answered with the same response, until the configuration or state
+        changes.
+        """
+        locator = self.locator()
+        next_deployment = arbitrary_transformation(_TEST_DEPLOYMENT)
+
+        def send_stale_diff():
+            return locator.cluster_updated_diff(
+                TEST_ACTION,
+                configuration_diff=create_diff(
+                    next_deployment, _TEST_DEPLOYMENT),
+                start_configuration_generation=make_generation_hash(
+                    next_deployment),
+                end_configuration_generation=make_generation_hash(
+                    _TEST_DEPLOYMENT),
+                state_diff=create_diff(self.state, self.state),
+                start_state_generation=make_generation_hash(self.state),
+                end_state_generation=make_generation_hash(self.state),
+            )
+        first = send_stale_diff()
+        second = send_stale_diff()
+        updated = locator.cluster_updated(
+            TEST_ACTION, next_deployment,
+            make_generation_hash(next_deployment),
+            self.state, make_generation_hash(self.state),
+        )
+        self.assertEqual(
+            (True, make_generation_hash(next_deployment)),
+            (first is second, updated['current_generations'].config_hash))
+
+
 def iconvergence_agent_tests_factory(fixture):
     """
     Create tests that verify basic ``IConvergenceAgent`` compliance.
@@ -1506,10 +1946,12 @@ class SendStateToConnectionsTests(TestCase):
             LOG_SEND_CLUSTER_STATE,
             succeeded=True,
             endFields={
-                "configuration": (
+                "configuration": wire_encode(
                     control_amp_service.configuration_service.get()
                 ),
-                "state": control_amp_service.cluster_state.as_deployment()
+                "state": wire_encode(
+                    control_amp_service.cluster_state.as_deployment()
+                ),
             }
         )
 
@@ -1547,12 +1989,36 @@ class PingTestsMixin(object):
         peer = AMP(locator=locator)
         protocol = self.build_protocol(reactor)
         pump = connectedServerAndClient(lambda: protocol, lambda: peer)[2]
+        # Let the protocol send any commands it sends shortly after
+        # connecting.  These postpone the pings a little.
+        reactor.advance(CONTROL_SERVICE_BATCHING_DELAY)
+        pump.flush()
         for i in range(expected_pings):
             reactor.advance(PING_INTERVAL.total_seconds())
             peer.callRemote(NoOp)  # Keep the other side alive past its timeout
             pump.flush()
         self.assertEqual(locator.noops, expected_pings)
 
+    def test_no_noops_when_busy(self):
+        """
+        The protocol does not send a ``NoOp`` command until it has sent no
+        other command for the ping interval.
+        """
+        reactor = Clock()
+        locator = _NoOpCounter()
+        peer = AMP(locator=locator)
+        protocol = self.build_protocol(reactor)
+        pump = connectedServerAndClient(lambda: protocol, lambda: peer)[2]
+        reactor.advance(PING_INTERVAL.total_seconds() / 2)
+        protocol.callRemote(NoOp)
+        pump.flush()
+        reactor.advance(PING_INTERVAL.total_seconds() / 2)
+        pump.flush()
+        busy_noops = locator.noops
+        reactor.advance(PING_INTERVAL.total_seconds() / 2)
+        pump.flush()
+        self.assertEqual((busy_noops, locator.noops), (1, 2))
+
     def test_stop_pinging_on_connection_lost(self):
         """
         When the protocol loses its connection, it stops trying to send
@@ -1666,3 +2132,167 @@ class CachingWireEncodeTests(TestCase):
              caching_wire_encode(_TEST_DEPLOYMENT) is result1,
              caching_wire_encode(NODE_STATE) is result2],
             [True, True, True, True])
+
+
+class CachingWireEncodeConcurrencyTests(TestCase):
+    """
+    Tests for ``caching_wire_encode`` when called from multiple threads.
+    """
+    def test_single_encode(self):
+        """
+        While an object is being encoded, other calls to encode the same
+        object wait for that encoding rather than encoding it again.
+        """
+        started = Event()
+        release = Event()
+        calls = []
+
+        def slow_wire_encode(obj):
+            calls.append(obj)
+            started.set()
+            release.wait()
+            return wire_encode(obj)
+        self.patch(_protocol, "wire_encode", slow_wire_encode)
+
+        obj = Deployment(nodes={Node(uuid=uuid4())})
+        results = []
+        first = Thread(target=lambda: results.append(caching_wire_encode(obj)))
+        first.start()
+        started.wait()
+        second = Thread(
+            target=lambda: results.append(caching_wire_encode(obj)))
+        second.start()
+        release.set()
+        first.join()
+        second.join()
+
+        self.assertEqual(
+            ([obj], 2, True),
+            (calls, len(results), results[0] is results[1]))
+
+
+class ShardedLRUCacheTests(TestCase):
+    """
+    Tests for ``_ShardedLRUCache``.
+    """
+    def test_missing(self):
+        """
+        ``get`` returns the default for a key that was never cached.
+        """
+        cache = _ShardedLRUCache(shards=4, size_per_shard=2)
+        self.assertEqual(
+            [None, 123], [cache.get(u"key"), cache.get(u"key", 123)])
+
+    def test_put(self):
+        """
+        ``get`` returns a value previously cached with ``put``.
+        """
+        cache = _ShardedLRUCache(shards=4, size_per_shard=2)
+        value = object()
+        cache.put(u"key", value)
+        self.assertIs(value, cache.get(u"key"))
+
+    def test_evicts_least_recently_used(self):
+        """
+        When a shard is full, the least recently used entry in that shard is
+        evicted.
+        """
+        cache = _ShardedLRUCache(shards=1, size_per_shard=2)
+        cache.put(1, u"a")
+        cache.put(2, u"b")
+        # Using 1 makes 2 the least recently used:
+        cache.get(1)
+        cache.put(3, u"c")
+        self.assertEqual(
+            [u"a", None, u"c"], [cache.get(1), cache.get(2), cache.get(3)])
+
+    def test_get_or_put_missing(self):
+        """
+        ``get_or_put`` computes and caches a value which is missing.
+        """
+        cache = _ShardedLRUCache(shards=4, size_per_shard=2)
+        self.assertEqual(
+            [u"keykey", u"keykey"],
+            [cache.get_or_put(u"key", lambda key: key * 2),
+             cache.get(u"key")])
+
+    def test_get_or_put_cached(self):
+        """
+        ``get_or_put`` returns a cached value without computing it.
+        """
+        cache = _ShardedLRUCache(shards=4, size_per_shard=2)
+        cache.put(u"key", u"value")
+        self.assertEqual(
+            u"value", cache.get_or_put(u"key", lambda key: 1 / 0))
+
+    def test_get_or_put_error(self):
+        """
+        If computing a value fails, ``get_or_put`` raises the exception and
+        caches nothing, so a later call computes the value again.
+        """
+        cache = _ShardedLRUCache(shards=4, size_per_shard=2)
+        self.assertRaises(
+            ZeroDivisionError, cache.get_or_put, u"key", lambda key: 1 / 0)
+        self.assertEqual(
+            u"value", cache.get_or_put(u"key", lambda key: u"value"))
+
+    def test_shards_independent(self):
+        """
+        Filling one shard does not evict entries from another.
+        """
+        cache = _ShardedLRUCache(shards=2, size_per_shard=1)
+        keys = [object() for _ in range(16)]
+        first = keys[0]
+        [second] = [
+            key for key in keys
+            if cache._shard_for(id(key)) is not cache._shard_for(id(first))
+        ][:1]
+        cache.put(first, u"a")
+        cache.put(second, u"b")
+        self.assertEqual([u"a", u"b"], [cache.get(first), cache.get(second)])
+
+    def test_identity(self):
+        """
+        Keys are looked up by identity, so an equal but different key does
+        not find a cached value.
+        """
+        cache = _ShardedLRUCache(shards=4, size_per_shard=2)
+        key = Deployment()
+        equal_key = Deployment()
+        cache.put(key, u"value")
+        self.assertEqual(
+            [True, u"value", None],
+            [key == equal_key, cache.get(key), cache.get(equal_key)])
+
+    def test_keeps_key_alive(self):
+        """
+        A cached key is not garbage collected, so its ``id`` cannot be reused
+        by another object while its value is cached.
+        """
+        cache = _ShardedLRUCache(shards=4, size_per_shard=2)
+        key = Deployment()
+        key_ref = ref(key)
+        cache.put(key, u"value")
+        del key
+        gc.collect()
+        self.assertEqual(u"value", cache.get(key_ref()))
+
+    def test_no_hashing(self):
+        """
+        Neither caching a value nor looking it up again hashes the key, which
+        for large pyrsistent objects means walking all of their contents.
+        """
+        hashed = []
+
+        class Key(object):
+            def __hash__(self):
+                hashed.append(self)
+                return 0
+
+        cache = _ShardedLRUCache(shards=4, size_per_shard=2)
+        key = Key()
+        cache.get_or_put(key, lambda key: u"value")
+        self.assertEqual(
+            ([u"value", u"value"], []),
+            ([cache.get(key), cache.get_or_put(key, lambda key: 1 / 0)],
+             hashed))
@@ -142,6 +142,15 @@ class DelayedAMPClient(object):
         d, response = self._calls.pop(0)
         response.chainDeferred(d)
 
+    def fail(self, reason):
+        """
+        Fail the oldest outstanding remote call, discarding its response.
+
+        :param Exception reason: The exception to fail the call with.
+        """
+        d, response = self._calls.pop(0)
+        d.errback(reason)
+
 
 def connected_amp_protocol():
     """
@@ -85,6 +85,22 @@ class DelayedAMPClientTests(TestCase):
             expected_response,
         )
 
+    def test_fail(self):
+        """
+        Calling :method:`fail` causes the deferred returned by
+        :method:`callRemote` to fail with the given exception.
+        """
+        expected_arguments = {'argument': 42}
+        client = FakeAMPClient()
+        client.register_response(
+            TestCommand, expected_arguments, {'response': 7})
+        delayed_client = DelayedAMPClient(client)
+
+        d = delayed_client.callRemote(TestCommand, **expected_arguments)
+
+        delayed_client.fail(ZeroDivisionError())
+        self.failureResultOf(d, ZeroDivisionError)
+
     # Missing test: Handling of multiple calls.
 
 